@@ -1,5 +1,7 @@
 import os
-from flask import Flask, send_from_directory, render_template 
+from urllib.parse import urlencode
+from flask import Flask, send_from_directory, render_template, request, abort, Response
+from werkzeug.security import safe_join
 import socket
 
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -13,8 +15,20 @@ app = Flask(__name__,
 from routes import register_blueprints
 register_blueprints(app)
 
-from config import HLS_DIR
+from config import HLS_DIR, PRETRANSCODE_AUTORUN, PRETRANSCODE_DIR, TRICKPLAY_DIR, DIRECT_PLAY_X_SENDFILE
+from models import stream_state
+from utils.segment_store import segment_store, content_type_for, playlist_with_query, CONTENT_TYPES
+from utils.parallel import ParallelTranscode
+from utils.pretranscode import pretranscode_queue
+from utils.ffmpeg import cleanup_stale_jobs
 os.makedirs(HLS_DIR, exist_ok=True)
+# Output of streams that were running when the server last stopped
+cleanup_stale_jobs(HLS_DIR, keep=(PRETRANSCODE_DIR, TRICKPLAY_DIR))
+
+app.config['USE_X_SENDFILE'] = DIRECT_PLAY_X_SENDFILE
+
+if PRETRANSCODE_AUTORUN:
+    pretranscode_queue.start()
 
 
 @app.route('/health')
@@ -24,7 +38,41 @@ def health():
 
 @app.route('/hls/<path:filename>')
 def serve_hls(filename):
-    return send_from_directory(HLS_DIR, filename)
+    # Only stream output of live jobs; not logs, queue files or other folders
+    if not filename.endswith(tuple(CONTENT_TYPES)):
+        abort(404)
+    job_id, _, name = filename.partition('/')
+    job = stream_state.jobs.get(job_id)
+    if job is None:
+        abort(404)
+    # Players carry ?c=<client id> from the /api/start URL; playlists below
+    # pass it on to every URI so segment fetches are counted per viewer
+    tag = request.args.get('c')
+    client_id = tag or request.remote_addr
+    job.touch(client_id, request.remote_addr)
+    if isinstance(job.process, ParallelTranscode):
+        job.process.note_fetch(name)
+    if job.audio is not None and job.audio.request(name, client_id):
+        # The audio rendition was just started; hls.js retries the playlist
+        return Response(status=503, headers={'Retry-After': '1', 'Cache-Control': 'no-cache'})
+    if job.in_memory:
+        data = segment_store.get(filename)
+        if data is None:
+            abort(404)
+        segment_store.client_fetched(client_id, filename)
+    elif tag and name.endswith('.m3u8'):
+        path = safe_join(job.output_dir, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (OSError, TypeError):
+            abort(404)
+    else:
+        return send_from_directory(job.output_dir, name)
+    if tag and name.endswith('.m3u8'):
+        data = playlist_with_query(data.decode('utf-8', 'replace'), urlencode({'c': tag}))
+    return Response(data, mimetype=content_type_for(filename),
+                    headers={'Cache-Control': 'no-cache'})
 
 
 @app.route('/player')
@@ -45,4 +45,60 @@ PRESETS = {
         "v_profile": ["-preset", "p7", "-b:v", "8M"],
         "a_codec": "aac",
     }
-}
\ No newline at end of file
+}
+
+# Segment storage: "disk" has FFmpeg write into HLS_DIR, "memory" has it PUT
+# segments to a loopback ingest server and serves them from RAM
+SEGMENT_STORE = os.environ.get("SEGMENT_STORE", "disk")
+SEGMENT_STORE_MAX_MB = int(os.environ.get("SEGMENT_STORE_MAX_MB", "256"))
+INGEST_PORT = int(os.environ.get("INGEST_PORT", "0"))
+
+# Parallel chunked transcoding: split the source into keyframe-aligned ranges
+# and encode them with several FFmpeg workers at once
+PARALLEL_TRANSCODE = os.environ.get("PARALLEL_TRANSCODE", "0") == "1"
+PARALLEL_WORKERS = int(os.environ.get("PARALLEL_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PARALLEL_RANGE_SECONDS = int(os.environ.get("PARALLEL_RANGE_SECONDS", "120"))
+
+# Pre-transcoded library output, kept separate from the live stream chunks
+PRETRANSCODE_DIR_RAW = os.environ.get("PRETRANSCODE_DIR", str(Path(HLS_DIR_RAW) / "library"))
+PRETRANSCODE_DIR = Path(PRETRANSCODE_DIR_RAW).as_posix()
+PRETRANSCODE_WORKERS = int(os.environ.get("PRETRANSCODE_WORKERS", "1"))
+# Only run queued jobs inside this local-time window, e.g. "01:00-06:00" (empty = any time)
+PRETRANSCODE_WINDOW = os.environ.get("PRETRANSCODE_WINDOW", "")
+# Run the queue inside the web server; disable to use `python pretranscode.py run` instead
+PRETRANSCODE_AUTORUN = os.environ.get("PRETRANSCODE_AUTORUN", "1") == "1"
+
+# Serve browser-native MP4s (H.264/AAC, faststart) as-is instead of transcoding
+DIRECT_PLAY = os.environ.get("DIRECT_PLAY", "1") == "1"
+# Let a fronting web server (Apache mod_xsendfile, lighttpd) send file bodies via X-Sendfile
+DIRECT_PLAY_X_SENDFILE = os.environ.get("DIRECT_PLAY_X_SENDFILE", "0") == "1"
+
+# Stop a viewer's share of a transcode after this many seconds without requests
+STREAM_IDLE_TIMEOUT = int(os.environ.get("STREAM_IDLE_TIMEOUT", "300"))
+
+# Preset to retry with when a preset's encoder fails to start (e.g. no NVENC GPU)
+PRESET_FALLBACKS = {
+    "gpu_nvenc_high_quality": "gpu_nvenc",
+    "gpu_nvenc": "cpu_fast",
+}
+# How long to watch a new FFmpeg process for early failure before reporting "started"
+STARTUP_WATCH_SECONDS = float(os.environ.get("STARTUP_WATCH_SECONDS", "1.0"))
+
+# Remote transcode workers (see worker.py). A worker that misses heartbeats for
+# WORKER_TIMEOUT seconds, or a lease not renewed in time, moves its jobs elsewhere.
+# Workers are refused until WORKER_TOKEN is set.
+WORKER_TOKEN = os.environ.get("WORKER_TOKEN", "")
+WORKER_TIMEOUT = int(os.environ.get("WORKER_TIMEOUT", "15"))
+WORKER_LEASE_SECONDS = int(os.environ.get("WORKER_LEASE_SECONDS", "15"))
+
+# Encode files with several audio tracks video-only and serve each track as an
+# HLS audio rendition, transcoded the first time a player selects it
+AUDIO_RENDITIONS = os.environ.get("AUDIO_RENDITIONS", "1") == "1"
+
+# Seek-preview sprite sheets + WebVTT index, generated in the background at idle
+# priority and kept in a size-bounded cache keyed by file identity
+TRICKPLAY = os.environ.get("TRICKPLAY", "1") == "1"
+TRICKPLAY_DIR_RAW = os.environ.get("TRICKPLAY_DIR", str(Path(HLS_DIR_RAW) / "trickplay"))
+TRICKPLAY_DIR = Path(TRICKPLAY_DIR_RAW).as_posix()
+TRICKPLAY_MAX_MB = int(os.environ.get("TRICKPLAY_MAX_MB", "200"))
+TRICKPLAY_INTERVAL = int(os.environ.get("TRICKPLAY_INTERVAL", "10"))
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+"""
+Bedtime Streamer - Load generator
+Simulates HLS viewers against a running server and reports latency, stalls and server load
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urljoin
+
+from config import PRESETS
+from utils.ffmpeg import get_video_metadata
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values`, or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def generate_media(folder, count, duration):
+    """Write `count` synthetic test titles (H.264 + AAC in MKV) into `folder`."""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"synthetic_{i:02d}_{duration}s.mkv")
+        if not os.path.exists(path):
+            print(f"Generating {path}")
+            cmd = [
+                'ffmpeg', '-y', '-v', 'error',
+                '-f', 'lavfi', '-i', f"testsrc2=size=1280x720:rate=24:duration={duration}",
+                '-f', 'lavfi', '-i', f"sine=frequency={220 + 110 * i}:sample_rate=48000:duration={duration}",
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '48', '-pix_fmt', 'yuv420p',
+                '-c:a', 'aac', '-b:a', '128k',
+                '-shortest', path
+            ]
+            subprocess.run(cmd, check=True)
+        paths.append(path)
+    return paths
+
+
+def parse_playlist(text, base_url):
+    """Return (init URL, [(segment URL, duration)], ended) for a media playlist."""
+    init = None
+    segments = []
+    duration = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-MAP:') and init is None:
+            uri = line.split('URI="', 1)[1].split('"', 1)[0]
+            init = urljoin(base_url, uri)
+        elif line.startswith('#EXTINF:'):
+            duration = float(line[8:].split(',')[0])
+        elif line and not line.startswith('#') and duration is not None:
+            segments.append((urljoin(base_url, line), duration))
+            duration = None
+    return init, segments, '#EXT-X-ENDLIST' in text
+
+
+class Stats:
+    """Latency samples and counters shared by every simulated client."""
+
+    def __init__(self):
+        self.latency = {"start": [], "seek": [], "first_segment": [], "playlist": [], "segment": []}
+        self.stalls = 0
+        self.stall_seconds = 0.0
+        self.stalled_clients = set()
+        self.errors = {}
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, kind, seconds):
+        with self._lock:
+            self.latency[kind].append(seconds)
+
+    def stall(self, client):
+        with self._lock:
+            self.stalls += 1
+            self.stalled_clients.add(client)
+
+    def stalled_for(self, seconds):
+        with self._lock:
+            self.stall_seconds += seconds
+
+    def error(self, message):
+        with self._lock:
+            self.errors[message] = self.errors.get(message, 0) + 1
+
+    def add_bytes(self, n):
+        with self._lock:
+            self.bytes += n
+
+
+class Client(threading.Thread):
+    """One viewer: start, poll the playlist, fetch segments at realtime pace, seek, stop.
+
+    Segments are fetched while less than `buffer` seconds are buffered ahead of
+    the simulated playhead. When the playhead reaches the end of the buffer and
+    the next segment is not in the playlist yet, the client has stalled.
+    """
+
+    def __init__(self, idx, server, movie, duration, stats, preset, watch, seeks,
+                 buffer, parallel, timeout):
+        super().__init__(daemon=True)
+        self.idx = idx
+        self.client_id = f"loadtest-{idx}"
+        self.server = server
+        self.movie = movie
+        self.duration = duration
+        self.stats = stats
+        self.preset = preset
+        self.watch = watch
+        self.seeks = seeks
+        self.buffer = buffer
+        self.parallel = parallel
+        self.timeout = timeout
+        self.state = "waiting"
+
+    def request(self, url, payload=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return resp.read()
+
+    def timed_get(self, kind, url):
+        """GET `url`; records latency on success and returns the body, or None on 404."""
+        t0 = time.monotonic()
+        try:
+            body = self.request(url)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+        self.stats.record(kind, time.monotonic() - t0)
+        self.stats.add_bytes(len(body))
+        return body
+
+    def start_stream(self, kind, start_time=None):
+        payload = {"path": self.movie, "preset": self.preset, "client_id": self.client_id,
+                   "direct": False}
+        if self.parallel:
+            payload['parallel'] = True
+        if start_time:
+            payload['start_time'] = start_time
+        t0 = time.monotonic()
+        reply = json.loads(self.request(self.server + '/api/start', payload))
+        self.stats.record(kind, time.monotonic() - t0)
+        if reply.get('status') != 'started' or reply.get('mode') == 'direct':
+            raise RuntimeError(f"start failed: {reply.get('message') or reply.get('mode')}")
+        return urljoin(self.server + '/', reply['url'])
+
+    def run(self):
+        try:
+            self.play()
+        except Exception as e:
+            self.stats.error(f"{type(e).__name__}: {e}")
+            self.state = "error"
+        finally:
+            try:
+                self.request(self.server + '/api/stop', {"client_id": self.client_id})
+            except Exception:
+                pass
+            if self.state != "error":
+                self.state = "done"
+
+    def open_stream(self, url):
+        """Return the Tracks to play: the media playlist, or a master's video variant and default audio."""
+        body = self.timed_get("playlist", url)
+        text = body.decode('utf-8', 'replace') if body is not None else ""
+        if '#EXT-X-STREAM-INF' not in text:
+            return [Track(url)]
+        video, audio = None, None
+        lines = [line.strip() for line in text.splitlines()]
+        for i, line in enumerate(lines):
+            if line.startswith('#EXT-X-STREAM-INF') and video is None:
+                video = urljoin(url, next(l for l in lines[i + 1:] if l and not l.startswith('#')))
+            elif line.startswith('#EXT-X-MEDIA:') and 'TYPE=AUDIO' in line and \
+                    (audio is None or 'DEFAULT=YES' in line):
+                audio = urljoin(url, line.split('URI="', 1)[1].split('"', 1)[0])
+        return [Track(video)] + ([Track(audio)] if audio else [])
+
+    def play(self):
+        began = time.monotonic()
+        deadline = began + self.watch
+        seek_times = [began + self.watch * (i + 1) / (self.seeks + 1) for i in range(self.seeks)]
+        self.state = "starting"
+        tracks = self.open_stream(self.start_stream("start"))
+        kind = "first_segment"
+        t_request = time.monotonic()
+
+        position = 0.0          # playhead at `wall`
+        wall = None             # None until every track has its first segment
+        playing = False
+        stall_began = None
+
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                if stall_began is not None:
+                    self.stats.stalled_for(now - stall_began)
+                return
+            # Playback can only run as far as the least-buffered track
+            buffered = min(t.buffered for t in tracks)
+            if playing:
+                pos = min(buffered, position + now - wall)
+                if all(t.finished() for t in tracks) and pos >= buffered:
+                    return
+                if pos >= buffered:
+                    playing = False
+                    position = pos
+                    stall_began = now
+                    self.state = "stalled"
+                    self.stats.stall(self.client_id)
+
+            if seek_times and now >= seek_times[0]:
+                seek_times.pop(0)
+                if stall_began is not None:
+                    self.stats.stalled_for(now - stall_began)
+                target = random.uniform(0, max(0.0, (self.duration or self.watch) * 0.8))
+                self.state = "seeking"
+                tracks = self.open_stream(self.start_stream("seek", round(target, 1)))
+                kind = "first_segment"
+                t_request = time.monotonic()
+                position, wall, playing, stall_began = 0.0, None, False, None
+                continue
+
+            played = min(buffered, position + now - wall) if playing else position
+            fetched = False
+            for track in sorted(tracks, key=lambda t: t.buffered):
+                if wall is not None and track.buffered - played >= self.buffer:
+                    continue
+                if track.waiting() and now - track.last_poll >= 1.0:
+                    track.refresh(self, now)
+                if track.ready():
+                    fetched = track.fetch_next(self)
+                    break
+
+            if fetched:
+                now = time.monotonic()
+                if min(t.buffered for t in tracks) <= 0:
+                    continue
+                if wall is None:
+                    self.stats.record(kind, now - t_request)
+                    position, wall, playing = 0.0, now, True
+                    self.state = "playing"
+                elif not playing:
+                    self.stats.stalled_for(now - stall_began)
+                    wall, playing = now, True
+                    stall_began = None
+                    self.state = "playing"
+                continue
+
+            time.sleep(0.1)
+
+
+class Track:
+    """Download state of one media playlist (video, or an audio rendition)."""
+
+    def __init__(self, url):
+        self.url = url
+        self.init_done = False
+        self.segments = []
+        self.ended = False
+        self.next_idx = 0
+        self.buffered = 0.0     # seconds of media downloaded
+        self.last_poll = 0.0
+
+    def waiting(self):
+        return self.next_idx >= len(self.segments) and not self.ended
+
+    def finished(self):
+        return self.next_idx >= len(self.segments) and self.ended
+
+    def ready(self):
+        return self.init_done and self.next_idx < len(self.segments)
+
+    def refresh(self, client, now):
+        self.last_poll = now
+        text = client.timed_get("playlist", self.url)
+        if text is None:
+            return
+        init, self.segments, self.ended = parse_playlist(text.decode('utf-8', 'replace'), self.url)
+        if not self.init_done:
+            self.init_done = init is None or client.timed_get("segment", init) is not None
+
+    def fetch_next(self, client):
+        seg_url, seg_duration = self.segments[self.next_idx]
+        if client.timed_get("segment", seg_url) is None:
+            # Listed but gone (e.g. evicted from memory): treat as not ready
+            client.stats.error("segment 404")
+            time.sleep(0.5)
+            return False
+        self.next_idx += 1
+        self.buffered += seg_duration
+        return True
+
+
+class ServerMonitor(threading.Thread):
+    """Samples CPU and resident memory of the server and its FFmpeg children."""
+
+    def __init__(self, pid, interval=1.0):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stopping = threading.Event()
+        self._page = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self._tick = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    @staticmethod
+    def available():
+        return psutil is not None or os.path.exists('/proc/self/stat')
+
+    def _proc_tree(self):
+        """(cpu seconds, rss bytes, process count) from /proc, for hosts without psutil."""
+        parents = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            parents[int(entry)] = (int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[21]))
+        tree, todo = set(), [self.pid]
+        while todo:
+            pid = todo.pop()
+            if pid in tree or pid not in parents:
+                continue
+            tree.add(pid)
+            todo.extend(p for p, info in parents.items() if info[0] == pid)
+        cpu = sum(parents[p][1] for p in tree) / self._tick
+        rss = sum(parents[p][2] for p in tree) * self._page
+        return cpu, rss, len(tree)
+
+    def _psutil_tree(self):
+        root = psutil.Process(self.pid)
+        cpu, rss, count = 0.0, 0, 0
+        for p in [root] + root.children(recursive=True):
+            try:
+                times = p.cpu_times()
+                cpu += times.user + times.system
+                rss += p.memory_info().rss
+                count += 1
+            except psutil.Error:
+                continue
+        return cpu, rss, count
+
+    def sample(self):
+        return self._psutil_tree() if psutil is not None else self._proc_tree()
+
+    def run(self):
+        began = time.monotonic()
+        last_cpu, last_t = self.sample()[0], began
+        while not self._stopping.wait(self.interval):
+            try:
+                cpu, rss, count = self.sample()
+            except Exception:
+                return
+            now = time.monotonic()
+            self.samples.append({
+                "t": round(now - began, 1),
+                "cpu_percent": round(100 * (cpu - last_cpu) / (now - last_t), 1),
+                "rss_mb": round(rss / 1048576, 1),
+                "processes": count,
+            })
+            last_cpu, last_t = cpu, now
+
+    def stop(self):
+        self._stopping.set()
+
+
+def spawn_server(media_dir, hls_dir):
+    """Start app.py with the synthetic library and wait for /health."""
+    env = dict(os.environ, LIBRARY_PATH=media_dir, HLS_DIR=hls_dir, PRETRANSCODE_AUTORUN='0')
+    proc = subprocess.Popen([sys.executable, os.path.join(PROJECT_ROOT, 'app.py')], env=env,
+                            cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            urllib.request.urlopen('http://127.0.0.1:5000/health', timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("server did not come up on port 5000")
+
+
+def print_report(stats, clients, samples, elapsed):
+    print()
+    print(f"{len(clients)} clients, {elapsed:.0f}s, {stats.bytes / 1048576:.1f} MB fetched")
+    print(f"{'':<14}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for kind, values in stats.latency.items():
+        if not values:
+            continue
+        p50, p99 = percentile(values, 50), percentile(values, 99)
+        print(f"{kind:<14}{len(values):>7}{p50 * 1000:>10.0f}{p99 * 1000:>10.0f}{max(values) * 1000:>10.0f}")
+    print(f"stalls: {stats.stalls} in {len(stats.stalled_clients)}/{len(clients)} clients, "
+          f"{stats.stall_seconds:.1f}s total")
+    for message, count in sorted(stats.errors.items(), key=lambda e: -e[1]):
+        print(f"error x{count}: {message}")
+    if samples:
+        cpu = [s['cpu_percent'] for s in samples]
+        rss = [s['rss_mb'] for s in samples]
+        print(f"server cpu: avg {sum(cpu) / len(cpu):.0f}%  peak {max(cpu):.0f}%   "
+              f"rss: peak {max(rss):.0f} MB   processes: peak {max(s['processes'] for s in samples)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate HLS viewers against Bedtime Streamer')
+    parser.add_argument('--server', default='http://127.0.0.1:5000', help='Server URL')
+    parser.add_argument('--clients', type=int, default=4, help='Simultaneous viewers')
+    parser.add_argument('--ramp', type=float, default=10, help='Seconds over which clients join')
+    parser.add_argument('--watch', type=float, default=60, help='Seconds each client watches')
+    parser.add_argument('--seeks', type=int, default=1, help='Seeks per client while watching')
+    parser.add_argument('--buffer', type=float, default=18, help='Seconds buffered ahead of the playhead')
+    parser.add_argument('--preset', default='cpu_fast', choices=list(PRESETS.keys()))
+    parser.add_argument('--parallel', action='store_true', help='Request parallel chunked transcodes')
+    parser.add_argument('--file', action='append', default=[],
+                        help='Media file to play (repeatable); default: generate synthetic titles')
+    parser.add_argument('--titles', type=int, default=2,
+                        help='Synthetic titles to generate; clients are spread across them')
+    parser.add_argument('--length', type=int, default=300, help='Length of synthetic titles (s)')
+    parser.add_argument('--media-dir', default=os.path.join(tempfile.gettempdir(), 'bedtime-loadtest'),
+                        help='Where synthetic titles are written')
+    parser.add_argument('--spawn', action='store_true',
+                        help='Start app.py on port 5000 with the media folder as its library')
+    parser.add_argument('--server-pid', type=int, help='PID of an already running server to sample')
+    parser.add_argument('--timeout', type=float, default=30, help='HTTP timeout (s)')
+    parser.add_argument('--interval', type=float, default=5, help='Seconds between progress lines')
+    parser.add_argument('--json', dest='json_path', help='Write samples and results to this file')
+    args = parser.parse_args()
+
+    files = args.file or generate_media(args.media_dir, args.titles, args.length)
+    durations = {}
+    for path in files:
+        metadata = get_video_metadata(path) or {}
+        durations[path] = metadata.get('duration')
+
+    server_proc = None
+    pid = args.server_pid
+    if args.spawn:
+        server_proc = spawn_server(os.path.dirname(os.path.abspath(files[0])),
+                                   tempfile.mkdtemp(prefix='bedtime-loadtest-hls-'))
+        args.server = 'http://127.0.0.1:5000'
+        pid = server_proc.pid
+    server = args.server.rstrip('/')
+
+    monitor = None
+    if pid and ServerMonitor.available():
+        monitor = ServerMonitor(pid)
+        monitor.start()
+    elif pid:
+        print("Install psutil to sample server CPU and memory on this platform")
+
+    stats = Stats()
+    clients = [Client(i, server, files[i % len(files)], durations[files[i % len(files)]], stats,
+                      args.preset, args.watch, args.seeks, args.buffer, args.parallel, args.timeout)
+               for i in range(args.clients)]
+
+    print(f"{len(clients)} clients over {len(files)} title(s) -> {server}")
+    began = time.monotonic()
+    try:
+        for i, client in enumerate(clients):
+            delay = began + args.ramp * i / max(1, len(clients)) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            client.start()
+
+        last = began
+        while any(c.is_alive() for c in clients):
+            time.sleep(0.5)
+            if time.monotonic() - last < args.interval:
+                continue
+            last = time.monotonic()
+            states = {}
+            for c in clients:
+                states[c.state] = states.get(c.state, 0) + 1
+            line = f"t={last - began:5.0f}s  " + "  ".join(f"{k}={v}" for k, v in sorted(states.items()))
+            line += f"  stalls={stats.stalls}"
+            if monitor and monitor.samples:
+                s = monitor.samples[-1]
+                line += f"  cpu={s['cpu_percent']:.0f}%  rss={s['rss_mb']:.0f}MB"
+            print(line)
+    except KeyboardInterrupt:
+        print("Interrupted")
+    finally:
+        elapsed = time.monotonic() - began
+        if monitor:
+            monitor.stop()
+        for c in clients:
+            if c.is_alive():
+                try:
+                    c.request(server + '/api/stop', {"client_id": c.client_id})
+                except Exception:
+                    pass
+        if server_proc:
+            server_proc.terminate()
+            server_proc.wait()
+
+    samples = monitor.samples if monitor else []
+    print_report(stats, clients, samples, elapsed)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({
+                "clients": len(clients),
+                "elapsed": round(elapsed, 1),
+                "latency": {k: {"count": len(v), "p50": percentile(v, 50), "p99": percentile(v, 99)}
+                            for k, v in stats.latency.items()},
+                "stalls": stats.stalls,
+                "stall_seconds": round(stats.stall_seconds, 1),
+                "errors": stats.errors,
+                "server": samples,
+            }, f, indent=2)
+        print(f"Wrote {args.json_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,151 @@
 """State management for the streaming application."""
 
+import hashlib
+import threading
+import time
+
+
+def job_key(movie_path, preset_key, sub_path=None, force_sync=False, start_time=None):
+    """Identity of a transcode: requests with the same key can share one job."""
+    return (movie_path, preset_key, sub_path or "", bool(force_sync), float(start_time or 0))
+
+
+def job_id_for(key):
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:12]
+
+
+class StreamJob:
+    """One transcode (or pre-built output) shared by every client watching it."""
+
+    def __init__(self, key, process, output_dir, owns_output=True, in_memory=False):
+        self.key = key
+        self.id = job_id_for(key)
+        self.process = process
+        self.output_dir = output_dir
+        # False for pre-transcoded output, which must survive the job
+        self.owns_output = owns_output
+        self.in_memory = in_memory
+        # Preset actually encoding, and startup failures that led to it
+        self.preset_key = key[1]
+        self.failures = []
+        # client id -> {"addr": remote address, "seen": last activity}
+        self.subscribers = {}
+        # AudioRenditions when the audio tracks are served separately
+        self.audio = None
+
+    def failed(self):
+        """True once the transcode has exited with an error."""
+        return self.process is not None and self.process.poll() not in (None, 0)
+
+    def touch(self, client_id, addr):
+        """Mark a subscriber active; requests without a client id match by address."""
+        now = time.monotonic()
+        if client_id in self.subscribers:
+            self.subscribers[client_id]['seen'] = now
+            return
+        for sub in self.subscribers.values():
+            if sub['addr'] == addr:
+                sub['seen'] = now
+
+
 class StreamState:
-    """Holds the global state for the streaming process."""
-    
+    """Holds the global state for the streaming processes.
+
+    Jobs are reference counted by subscriber: a job is stopped when its
+    last client stops or goes idle.
+    """
+
     def __init__(self):
-        self.current_process = None
+        self.jobs = {}
+        self.clients = {}
+        # job id -> Event set when the request launching that job is done
+        self.launching = {}
+        self.lock = threading.RLock()
+
+    def find(self, key):
+        """Return the live job for `key`; a job whose transcode failed counts as missing."""
+        with self.lock:
+            job = self.jobs.get(job_id_for(key))
+            if job is None or job.failed():
+                return None
+            return job
+
+    def reserve(self, key):
+        """Return the live job for `key`, or reserve launching it.
+
+        Returns (job, None) when a live job exists. Otherwise the caller
+        gets (None, dead), where `dead` is a failed job it must stop (or
+        None). The caller then launches the job outside the lock and calls
+        release(key). Other requests for the same key wait for that launch.
+        """
+        job_id = job_id_for(key)
+        while True:
+            with self.lock:
+                job = self.find(key)
+                if job is not None:
+                    return job, None
+                pending = self.launching.get(job_id)
+                if pending is None:
+                    self.launching[job_id] = threading.Event()
+                    return None, self.discard(key)
+            pending.wait()
+
+    def release(self, key):
+        with self.lock:
+            event = self.launching.pop(job_id_for(key), None)
+        if event is not None:
+            event.set()
+
+    def touch(self, client_id):
+        """Mark `client_id` active; returns its job, or None if it is not watching anything."""
+        with self.lock:
+            job = self.jobs.get(self.clients.get(client_id))
+            if job is None or client_id not in job.subscribers:
+                return None
+            job.touch(client_id, None)
+            return job
+
+    def discard(self, key):
+        """Unregister the job for `key` and its clients; returns it so it can be stopped."""
+        with self.lock:
+            job = self.jobs.pop(job_id_for(key), None)
+            if job is None:
+                return None
+            for client_id in job.subscribers:
+                if self.clients.get(client_id) == job.id:
+                    del self.clients[client_id]
+            return job
+
+    def attach(self, client_id, addr, job):
+        """Subscribe a client to `job`, registering the job if it is new.
+
+        Returns the jobs that lost their last subscriber and must be stopped.
+        """
+        with self.lock:
+            finished = self.detach(client_id) if self.clients.get(client_id) != job.id else []
+            job = self.jobs.setdefault(job.id, job)
+            job.subscribers[client_id] = {"addr": addr, "seen": time.monotonic()}
+            self.clients[client_id] = job.id
+            return [j for j in finished if j.id != job.id]
+
+    def detach(self, client_id):
+        """Unsubscribe a client; returns the job if it has no subscribers left."""
+        with self.lock:
+            job_id = self.clients.pop(client_id, None)
+            job = self.jobs.get(job_id)
+            if job is None:
+                return []
+            job.subscribers.pop(client_id, None)
+            if job.subscribers:
+                return []
+            del self.jobs[job_id]
+            return [job]
+
+    def idle_clients(self, timeout):
+        now = time.monotonic()
+        with self.lock:
+            return [c for job in self.jobs.values()
+                    for c, sub in job.subscribers.items() if now - sub['seen'] > timeout]
 
 # Global instance - imported where needed
-stream_state = StreamState()
\ No newline at end of file
+stream_state = StreamState()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Bedtime Streamer - Library pre-transcoding
+Queue files, folders or the whole library for background transcoding
+"""
+
+import argparse
+import os
+import sys
+
+from config import PRESETS
+from utils.pretranscode import pretranscode_queue
+
+
+def print_jobs(jobs):
+    for job in jobs:
+        pct = f"{job['progress'] * 100:5.1f}%"
+        line = f"{job['id']}  {job['status']:<9} {pct}  {job['preset']:<24} {job['path']}"
+        if job.get('error'):
+            line += f"  ({job['error']})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-transcode media for Bedtime Streamer')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    add = sub.add_parser('add', help='Queue files or folders for transcoding')
+    add.add_argument('paths', nargs='*', help='Video files or folders')
+    add.add_argument('--all', action='store_true', help='Queue the whole library')
+    add.add_argument('--preset', default='cpu_fast', choices=list(PRESETS.keys()))
+
+    sub.add_parser('list', help='Show queued jobs and progress')
+
+    cancel = sub.add_parser('cancel', help='Cancel a queued or running job')
+    cancel.add_argument('job_id')
+
+    remove = sub.add_parser('remove', help='Remove a job and delete its output')
+    remove.add_argument('job_id')
+
+    sub.add_parser('run', help='Work through the queue in the foreground')
+
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        if not args.all and not args.paths:
+            parser.error('give at least one path or --all')
+        jobs = []
+        if args.all:
+            jobs += pretranscode_queue.add_library(args.preset)
+        for path in args.paths:
+            if os.path.isdir(path):
+                jobs += pretranscode_queue.add_folder(path, args.preset)
+            else:
+                jobs.append(pretranscode_queue.add(path, args.preset))
+        print_jobs(jobs)
+    elif args.command == 'list':
+        print_jobs(pretranscode_queue.jobs())
+    elif args.command == 'cancel':
+        if not pretranscode_queue.cancel(args.job_id):
+            print(f"No active job {args.job_id}")
+            sys.exit(1)
+    elif args.command == 'remove':
+        if not pretranscode_queue.remove(args.job_id):
+            print(f"No job {args.job_id}")
+            sys.exit(1)
+    elif args.command == 'run':
+        print("Running pre-transcode queue, press Ctrl+C to stop")
+        try:
+            pretranscode_queue.run_forever()
+        except KeyboardInterrupt:
+            print("Stopped; running jobs will resume next time")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,15 +6,24 @@ from flask import Blueprint
 library_bp = Blueprint('library', __name__)
 stream_bp = Blueprint('stream', __name__)
 ui_bp = Blueprint('ui', __name__)
+pretranscode_bp = Blueprint('pretranscode', __name__)
+workers_bp = Blueprint('workers', __name__)
+trickplay_bp = Blueprint('trickplay', __name__)
 
 # Import route handlers to register them
 from . import library
 from . import stream
 from . import ui
+from . import pretranscode
+from . import workers
+from . import trickplay
 
 
 def register_blueprints(app):
     """Register all blueprints with the Flask app."""
     app.register_blueprint(library_bp)
     app.register_blueprint(stream_bp)
-    app.register_blueprint(ui_bp)
\ No newline at end of file
+    app.register_blueprint(ui_bp)
+    app.register_blueprint(pretranscode_bp)
+    app.register_blueprint(workers_bp)
+    app.register_blueprint(trickplay_bp)
\ No newline at end of file
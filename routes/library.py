@@ -5,6 +5,10 @@ from flask import jsonify, request
 from routes import library_bp
 from utils.filesystem import scan_library
 from utils.ffmpeg import get_video_metadata
+from utils.keyframes import keyframe_indexer
+from utils.directplay import direct_play_check, in_library
+from utils.trickplay import trickplay_cache
+from config import TRICKPLAY
 
 
 @library_bp.route('/api/library', methods=['GET'])
@@ -16,5 +20,16 @@ def list_library():
 @library_bp.route('/api/probe', methods=['POST'])
 def probe_file():
     path = request.json.get('path')
+    if not in_library(path):
+        return jsonify({"error": "path is not in the library"}), 404
     metadata = get_video_metadata(path)
+    if metadata is not None:
+        metadata['direct_play'] = direct_play_check(path, metadata)
+    # Start the keyframe scan now so it is ready by the time /api/start runs
+    keyframe_indexer.request(path)
+    if TRICKPLAY and metadata is not None:
+        # Seek previews are built at idle priority while the user picks options
+        key = trickplay_cache.request(path)
+        if key is not None:
+            metadata['trickplay'] = trickplay_cache.url_for(key)
     return jsonify(metadata)
\ No newline at end of file
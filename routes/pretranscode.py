@@ -0,0 +1,45 @@
+"""Routes for the library pre-transcode queue."""
+
+from flask import jsonify, request
+
+from routes import pretranscode_bp
+from utils.pretranscode import pretranscode_queue
+from utils.directplay import in_library
+
+
+@pretranscode_bp.route('/api/pretranscode', methods=['GET'])
+def list_jobs():
+    return jsonify(pretranscode_queue.jobs())
+
+
+@pretranscode_bp.route('/api/pretranscode', methods=['POST'])
+def queue_jobs():
+    data = request.json or {}
+    preset_key = data.get('preset', 'cpu_fast')
+    try:
+        if data.get('all'):
+            jobs = pretranscode_queue.add_library(preset_key)
+        elif data.get('folder'):
+            if not in_library(data['folder'], folder=True):
+                return jsonify({"error": "folder is not in the library"}), 404
+            jobs = pretranscode_queue.add_folder(data['folder'], preset_key)
+        elif data.get('path'):
+            if not in_library(data['path']):
+                return jsonify({"error": "path is not in the library"}), 404
+            jobs = [pretranscode_queue.add(data['path'], preset_key)]
+        else:
+            return jsonify({"error": "path, folder or all is required"}), 400
+    except (ValueError, OSError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(jobs)
+
+
+@pretranscode_bp.route('/api/pretranscode/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if request.args.get('remove'):
+        removed = pretranscode_queue.remove(job_id)
+    else:
+        removed = pretranscode_queue.cancel(job_id)
+    if not removed:
+        return jsonify({"error": "job not found or already finished"}), 404
+    return jsonify({"status": "removed" if request.args.get('remove') else "cancelled"})
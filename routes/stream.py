@@ -1,22 +1,146 @@
 """Routes for starting and stopping the HLS stream."""
 
+import os
+import shutil
 import subprocess
+import threading
+import time
+from urllib.parse import urlencode
 
-from flask import jsonify, request
+from flask import jsonify, request, send_file, abort, url_for
 
 from routes import stream_bp
 from models import stream_state
-from config import PRESETS
-from utils.ffmpeg import get_video_metadata, build_ffmpeg_command, cleanup_hls_directory
+from models import StreamJob, job_key, job_id_for
+from config import (HLS_DIR, PRESETS, SEGMENT_STORE, PARALLEL_TRANSCODE, PARALLEL_WORKERS,
+                    PARALLEL_RANGE_SECONDS, DIRECT_PLAY, STREAM_IDLE_TIMEOUT,
+                    PRESET_FALLBACKS, STARTUP_WATCH_SECONDS, AUDIO_RENDITIONS)
+from utils.ffmpeg import get_video_metadata, build_ffmpeg_command, cleanup_hls_directory, FFmpegProcess
+from utils.keyframes import keyframe_indexer
+from utils.segment_store import segment_store, ingest_server
+from utils.parallel import ParallelTranscode
+from utils.pretranscode import pretranscode_queue
+from utils.directplay import direct_play_check, in_library
+from utils.workers import worker_pool
+from utils.renditions import AudioRenditions
+
+IDLE_CHECK_INTERVAL = 15
+STOP_TIMEOUT = 10
+KEYFRAME_WAIT_SECONDS = 5
+
+
+class StreamStartError(Exception):
+    """FFmpeg died during startup with every preset in the fallback chain."""
+
+    def __init__(self, failures):
+        super().__init__(failures[-1]['message'] if failures else "ffmpeg failed to start")
+        self.failures = failures
+
+_reaper = None
+
+
+def client_id_for(data):
+    """Clients identify themselves with a per-tab id; fall back to their address."""
+    return (data or {}).get('client_id') or request.remote_addr
+
+
+def stop_job(job):
+    """Stop a job that lost its last subscriber and free its output."""
+    if job.process is not None and job.process.poll() is None:
+        job.process.terminate()
+    if job.audio is not None:
+        job.audio.terminate()
+    if not job.owns_output:
+        return
+    # Let the encoders exit before removing the folder they write into
+    # (Windows cannot delete files that are still open)
+    for process in (job.process, job.audio):
+        if process is None:
+            continue
+        try:
+            process.wait(timeout=STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            print(f"Stream {job.id} did not stop within {STOP_TIMEOUT}s")
+    if job.in_memory:
+        segment_store.clear(job.id)
+    shutil.rmtree(job.output_dir, ignore_errors=True)
+
+
+def _reap_idle():
+    while True:
+        time.sleep(IDLE_CHECK_INTERVAL)
+        for client_id in stream_state.idle_clients(STREAM_IDLE_TIMEOUT):
+            for job in stream_state.detach(client_id):
+                print(f"Stopping idle stream {job.id}")
+                stop_job(job)
+
+
+def ensure_reaper():
+    global _reaper
+    if _reaper is None:
+        _reaper = threading.Thread(target=_reap_idle, daemon=True)
+        _reaper.start()
+
+
+def hls_url(job, client_id):
+    """Playlist URL for `client_id`; ?c= rides along on every URI it lists (see app.serve_hls)."""
+    name = "master.m3u8" if job.audio is not None else "index.m3u8"
+    return f"/hls/{job.id}/{name}?{urlencode({'c': client_id})}"
+
+
+def start_audio_renditions(job, movie_path, preset, metadata, force_sync, start_time,
+                           keyframes, output_url):
+    """Serve the audio tracks of `job` as renditions encoded on demand.
+
+    `keyframes` must be what the video encode snapped its start to (None
+    for remote workers, which do not have the index).
+    """
+    job.audio = AudioRenditions(
+        movie_path,
+        preset,
+        metadata['audio_tracks'],
+        force_sync=force_sync,
+        keyframes=keyframes,
+        start_time=start_time,
+        output_dir=job.output_dir,
+        output_url=output_url,
+        store=segment_store if output_url else None,
+        store_prefix=f"{job.id}/"
+    ).start()
+    return job
+
+
+@stream_bp.route('/api/ping', methods=['POST'])
+def ping_stream():
+    """Keep an open player subscribed while it fetches nothing, e.g. paused on a finished playlist.
+
+    Also reports the audio renditions whose encode failed, for the language menu.
+    """
+    client_id = client_id_for(request.get_json(silent=True))
+    job = stream_state.touch(client_id)
+    if job is None:
+        return jsonify({"status": "unknown"})
+    response = {"status": "ok"}
+    if job.audio is not None:
+        response['audio_failed'] = job.audio.failures()
+    return jsonify(response)
 
 
 @stream_bp.route('/api/stop', methods=['POST'])
 def stop_stream():
-    if stream_state.current_process:
-        stream_state.current_process.terminate()
-        stream_state.current_process = None
+    for job in stream_state.detach(client_id_for(request.get_json(silent=True))):
+        stop_job(job)
     return jsonify({"status": "stopped"})
 
+@stream_bp.route('/media', methods=['GET'])
+def serve_media():
+    """Serve a library file as-is; Range requests are answered with 206."""
+    path = request.args.get('path', '')
+    if not in_library(path):
+        abort(404)
+    return send_file(path, conditional=True)
+
+
 @stream_bp.route('/api/start', methods=['POST'])
 def start_stream():
     from models import stream_state
@@ -28,26 +152,183 @@ def start_stream():
     preset = PRESETS.get(preset_key)
     sub_path = data.get('sub_path')
     force_sync = data.get('force_sync', False)  
+    start_time = data.get('start_time')
+    parallel = data.get('parallel', PARALLEL_TRANSCODE)
+    direct = data.get('direct', DIRECT_PLAY)
+    client_id = client_id_for(data)
 
+    ensure_reaper()
     metadata = get_video_metadata(movie_path)
     
-    # Build command with force_sync flag
-    cmd, work_dir = build_ffmpeg_command(
-        movie_path, 
-        preset, 
-        metadata, 
-        sub_path,
-        force_sync=force_sync  
-    )
-    
-    cleanup_hls_directory()
-    
-    import os
-    original_dir = os.getcwd()
-    try:
-        os.chdir(work_dir)
-        stream_state.current_process = subprocess.Popen(cmd)
-    finally:
-        os.chdir(original_dir)
-    
-    return jsonify({"status": "started"})
\ No newline at end of file
+    # Browser-native files are served straight from disk
+    direct_play = direct_play_check(movie_path, metadata, sub_path)
+    if direct and direct_play['eligible'] and not force_sync and not start_time:
+        for job in stream_state.detach(client_id):
+            stop_job(job)
+        return jsonify({
+            "status": "started",
+            "mode": "direct",
+            "url": url_for('stream.serve_media', path=movie_path)
+        })
+    
+    # Use the keyframe index if the background scan has finished. Parallel
+    # mode needs it to place range boundaries, so give a running scan a few
+    # seconds; if it is still not ready, fall back to a single encoder.
+    if parallel:
+        keyframes = keyframe_indexer.wait(movie_path, KEYFRAME_WAIT_SECONDS)
+    else:
+        keyframes = keyframe_indexer.get(movie_path)
+        if keyframes is None:
+            keyframe_indexer.request(movie_path)
+    
+    key = job_key(movie_path, preset_key, sub_path, force_sync, start_time)
+    while True:
+        # Late joiners share the job already producing this exact output
+        job, dead = stream_state.reserve(key)
+        if job is None:
+            break
+        with stream_state.lock:
+            # Unless its last viewer left in the meantime
+            if stream_state.jobs.get(job.id) is job:
+                finished = stream_state.attach(client_id, request.remote_addr, job)
+                mode = "shared"
+                break
+    
+    if job is None:
+        # Launched outside the global lock: startup checks can take seconds,
+        # and only requests for this same key wait on them
+        try:
+            # A job that died keeps its id; clear it out before relaunching
+            if dead is not None:
+                print(f"Replacing failed stream {dead.id}")
+                stop_job(dead)
+            try:
+                job, mode = launch_job(key, movie_path, preset, preset_key, metadata, sub_path,
+                                       force_sync, start_time, keyframes, parallel)
+            except StreamStartError as e:
+                failure = e.failures[-1] if e.failures else {"error": "unknown", "message": str(e)}
+                return jsonify({"status": "error", "error": failure['error'],
+                                "message": failure['message'], "failures": e.failures}), 500
+            finished = stream_state.attach(client_id, request.remote_addr, job)
+        finally:
+            stream_state.release(key)
+    
+    for old in finished:
+        stop_job(old)
+    
+    response = {"status": "started", "mode": mode, "job": job.id,
+                "subscribers": len(job.subscribers),
+                "url": hls_url(job, client_id), "direct_play": direct_play}
+    if job.failures:
+        # Started, but only after falling back to another preset
+        response['preset'] = job.preset_key
+        response['fallback_from'] = [f['preset'] for f in job.failures]
+        response['failures'] = job.failures
+    return jsonify(response)
+
+
+def launch_job(key, movie_path, preset, preset_key, metadata, sub_path,
+               force_sync, start_time, keyframes, parallel):
+    """Start the encode (or pick up pre-built output) for a new job."""
+    job_id = job_id_for(key)
+    
+    # Serve a finished pre-transcode when nothing asks for a custom encode
+    if not sub_path and not force_sync and not start_time:
+        prebuilt = pretranscode_queue.find_output(movie_path, preset_key)
+        if prebuilt:
+            return StreamJob(key, None, prebuilt, owns_output=False), "prebuilt"
+    
+    output_dir = os.path.join(HLS_DIR, job_id)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # In memory mode FFmpeg PUTs its output to the loopback ingest server
+    output_url = None
+    if SEGMENT_STORE == 'memory':
+        output_url = f"{ingest_server.ensure_started()}/{job_id}"
+        segment_store.clear(job_id)
+    
+    # Multi-language files: encode video once, each audio track when selected
+    separate_audio = AUDIO_RENDITIONS and len(metadata.get('audio_tracks') or []) > 1
+    
+    use_parallel = parallel and keyframes is not None and len(keyframes) > 1
+    
+    # Hand the encode to the least-loaded remote worker when one has room
+    if not use_parallel:
+        spec = {
+            "movie_path": movie_path,
+            "preset": preset_key,
+            "sub_path": sub_path,
+            "force_sync": force_sync,
+            "start_time": start_time,
+            "metadata": metadata,
+            "audio": not separate_audio,
+        }
+        remote = worker_pool.submit(job_id, spec, output_dir,
+                                    store=segment_store if output_url else None)
+        if remote is not None:
+            job = StreamJob(key, remote, output_dir, in_memory=bool(output_url))
+            if separate_audio:
+                start_audio_renditions(job, movie_path, preset, metadata, force_sync,
+                                       start_time, None, output_url)
+            return job, "remote"
+    
+    # Try the requested preset, then its fallbacks if the encoder dies on startup
+    failures = []
+    while preset is not None:
+        if use_parallel:
+            process = ParallelTranscode(
+                movie_path,
+                preset,
+                metadata,
+                keyframes,
+                sub_path=sub_path,
+                force_sync=force_sync,
+                start_time=start_time,
+                workers=PARALLEL_WORKERS,
+                range_seconds=PARALLEL_RANGE_SECONDS,
+                output_dir=output_dir,
+                output_url=output_url,
+                store=segment_store if output_url else None,
+                store_prefix=f"{job_id}/",
+                audio=not separate_audio
+            ).start()
+            mode = "parallel"
+        else:
+            cmd, _ = build_ffmpeg_command(
+                movie_path, 
+                preset, 
+                metadata, 
+                sub_path,
+                force_sync=force_sync,
+                keyframes=keyframes,
+                start_time=start_time,
+                output_url=output_url,
+                audio=not separate_audio
+            )
+            process = FFmpegProcess(cmd, cwd=output_dir)
+            mode = "hls"
+        
+        failure = process.wait_for_startup(STARTUP_WATCH_SECONDS)
+        if failure is None:
+            job = StreamJob(key, process, output_dir, in_memory=bool(output_url))
+            job.preset_key = preset_key
+            job.failures = failures
+            if separate_audio:
+                start_audio_renditions(job, movie_path, preset, metadata, force_sync,
+                                       start_time, keyframes, output_url)
+            return job, mode
+        
+        failure['preset'] = preset_key
+        failures.append(failure)
+        print(f"FFmpeg failed to start with {preset_key}: {failure['message']}")
+        if failure['error'] != 'encoder_unavailable':
+            break
+        preset_key = PRESET_FALLBACKS.get(preset_key)
+        preset = PRESETS.get(preset_key)
+        if output_url:
+            segment_store.clear(job_id)
+        cleanup_hls_directory(output_dir)
+    
+    shutil.rmtree(output_dir, ignore_errors=True)
+    raise StreamStartError(failures)
@@ -0,0 +1,46 @@
+"""Routes for seek-preview sprite sheets."""
+
+import re
+
+from flask import jsonify, request, send_file, abort
+
+from routes import trickplay_bp
+from config import TRICKPLAY
+from utils.directplay import in_library
+from utils.trickplay import trickplay_cache, VTT_NAME
+
+_NAME_RE = re.compile(r'^(sprite_\d{3}\.jpg|thumbs\.vtt)$')
+
+
+@trickplay_bp.route('/api/trickplay', methods=['GET'])
+def trickplay_status():
+    """Report whether previews for ?path= are ready, queueing them if not."""
+    path = request.args.get('path', '')
+    if not TRICKPLAY:
+        return jsonify({"status": "disabled"})
+    if not in_library(path):
+        abort(404)
+    key = trickplay_cache.request(path)
+    if key is None:
+        abort(404)
+    _, status = trickplay_cache.status(path)
+    return jsonify({"status": status, "url": trickplay_cache.url_for(key)})
+
+
+@trickplay_bp.route('/trickplay/<key>/<name>', methods=['GET'])
+def trickplay_file(key, name):
+    if not re.fullmatch(r'[0-9a-f]{16}', key) or not _NAME_RE.match(name):
+        abort(404)
+    path = trickplay_cache.file_path(key, name)
+    if not path.exists():
+        abort(404)
+    if name == VTT_NAME:
+        # Revalidated on every view so the fetch reaches file_path() and
+        # keeps the entry recently used for eviction
+        response = send_file(path, mimetype='text/vtt')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    # The key changes with the file, so cached sprites never go stale
+    response = send_file(path, mimetype='image/jpeg')
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
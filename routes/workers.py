@@ -0,0 +1,57 @@
+"""Routes for remote transcode workers."""
+
+import hmac
+
+from flask import jsonify, request, abort
+
+from routes import workers_bp
+from config import WORKER_TOKEN
+from utils.workers import worker_pool
+
+
+def check_token():
+    # Remote workers stay disabled until a shared token is configured
+    token = request.headers.get('X-Worker-Token', '')
+    if not WORKER_TOKEN or not hmac.compare_digest(token.encode(), WORKER_TOKEN.encode()):
+        abort(403)
+
+
+@workers_bp.route('/api/workers', methods=['GET'])
+def list_workers():
+    check_token()
+    return jsonify(worker_pool.status())
+
+
+@workers_bp.route('/api/workers/heartbeat', methods=['POST'])
+def heartbeat():
+    check_token()
+    data = request.json or {}
+    worker_id = data.get('worker_id')
+    if not worker_id:
+        return jsonify({"error": "worker_id is required"}), 400
+    reply = worker_pool.heartbeat(
+        worker_id,
+        data.get('name', worker_id),
+        data.get('capacity', 1),
+        data.get('running', {}),
+        data.get('finished', [])
+    )
+    return jsonify(reply)
+
+
+@workers_bp.route('/api/workers/upload/<job_id>/<lease>/<name>', methods=['PUT', 'POST'])
+def upload(job_id, lease, name):
+    """Receive a playlist or segment that a worker's FFmpeg PUTs back."""
+    check_token()
+    if '..' in name or '\\' in name:
+        abort(400)
+    job = worker_pool.lease_valid(job_id, lease)
+    if job is None:
+        # Lease moved to another worker or the stream was stopped
+        abort(409)
+    if not job.write(name, request.get_data()):
+        # The stream was stopped while the upload waited for room
+        return '', 503
+    if name.endswith('.m3u8'):
+        job.write_playlist()
+    return '', 201
@@ -0,0 +1,83 @@
+"""Detection of files a browser can play as-is, without transcoding."""
+
+import struct
+from pathlib import Path
+
+from config import LIBRARY_PATH
+
+DIRECT_CONTAINERS = ('mp4', 'mov')
+DIRECT_VIDEO_CODECS = ('h264',)
+DIRECT_PIX_FMTS = ('yuv420p', 'yuvj420p')
+DIRECT_AUDIO_CODECS = ('aac', 'mp3', None)
+
+
+def moov_position(file_path):
+    """Return 'start' if the moov atom precedes mdat, 'end' if it follows it, else None."""
+    try:
+        with open(file_path, 'rb') as f:
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return None
+                size, kind = struct.unpack('>I4s', header)
+                if kind == b'moov':
+                    return 'start'
+                if kind == b'mdat':
+                    return 'end'
+                if size == 1:
+                    size = struct.unpack('>Q', f.read(8))[0]
+                    # A box can't be smaller than its own header; seeking
+                    # by a zero or negative amount would loop forever.
+                    if size < 16:
+                        return None
+                    f.seek(size - 16, 1)
+                elif size < 8:
+                    # 0 means "to end of file"; 2-7 are corrupt
+                    return None
+                else:
+                    f.seek(size - 8, 1)
+    except (OSError, struct.error):
+        return None
+
+
+def in_library(file_path, folder=False):
+    """True if `file_path` resolves to a file (a directory with `folder`) inside LIBRARY_PATH."""
+    try:
+        path = Path(file_path).resolve()
+        root = Path(LIBRARY_PATH).resolve()
+    except (OSError, TypeError):
+        return False
+    exists = path.is_dir() if folder else path.is_file()
+    return exists and (path == root or root in path.parents)
+
+
+def direct_play_check(file_path, metadata, sub_path=None):
+    """Decide whether `file_path` can be served as-is.
+
+    Returns {"eligible": bool, "reason": str or None}.
+    """
+    def no(reason):
+        return {"eligible": False, "reason": reason}
+
+    if not metadata:
+        return no("file could not be probed")
+    if sub_path or metadata.get('has_internal_subs'):
+        return no("subtitles need to be burned in")
+    containers = (metadata.get('container') or '').split(',')
+    if not any(c in DIRECT_CONTAINERS for c in containers) or \
+            not str(file_path).lower().endswith(('.mp4', '.mov', '.m4v')):
+        return no(f"container {metadata.get('container')} is not browser-native")
+    if metadata.get('codec') not in DIRECT_VIDEO_CODECS:
+        return no(f"video codec {metadata.get('codec')} is not browser-native")
+    if metadata.get('pix_fmt') not in DIRECT_PIX_FMTS:
+        return no(f"pixel format {metadata.get('pix_fmt')} is not browser-native")
+    if metadata.get('audio_codec') not in DIRECT_AUDIO_CODECS:
+        return no(f"audio codec {metadata.get('audio_codec')} is not browser-native")
+    if not in_library(file_path):
+        return no("file is outside the media library")
+    moov = moov_position(file_path)
+    if moov == 'end':
+        return no("moov atom is at the end of the file (not faststart)")
+    if moov is None:
+        return no("could not find the moov atom")
+    return {"eligible": True, "reason": None}
@@ -1,6 +1,12 @@
 import os
+import re
+import shutil
 import subprocess
+import sys
 import json
+import threading
+import time
+from collections import deque
 from pathlib import Path
 
 from config import HLS_DIR
@@ -18,6 +24,7 @@ def get_video_metadata(file_path):
         'ffprobe',
         '-v', 'error',
         '-show_streams',
+        '-show_format',
         '-of', 'json',
         file_path
     ]
@@ -40,27 +47,125 @@ def get_video_metadata(file_path):
                 sub_count += 1
 
         video_stream = next((s for s in data['streams'] if s['codec_type'] == 'video'), None)
+        audio_stream = next((s for s in data['streams'] if s['codec_type'] == 'audio'), None)
+        try:
+            duration = float(data.get('format', {}).get('duration'))
+        except (TypeError, ValueError):
+            duration = None
+        audio_tracks = [
+            {
+                "index": n,
+                "codec": a.get('codec_name'),
+                "channels": a.get('channels'),
+                "language": a.get('tags', {}).get('language'),
+                "title": a.get('tags', {}).get('title'),
+                "default": bool(a.get('disposition', {}).get('default')),
+            }
+            for n, a in enumerate(s for s in data['streams'] if s['codec_type'] == 'audio')
+        ]
         return {
             "has_internal_subs": (text_sub_index is not None or pgs_sub_index is not None),
             "text_sub_index": text_sub_index,
             "pgs_sub_index": pgs_sub_index,
             "codec": video_stream.get('codec_name') if video_stream else "unknown",
-            "resolution": f"{video_stream.get('width')}x{video_stream.get('height')}" if video_stream else "unknown"
+            "resolution": f"{video_stream.get('width')}x{video_stream.get('height')}" if video_stream else "unknown",
+            "duration": duration,
+            "container": data.get('format', {}).get('format_name', "unknown"),
+            "pix_fmt": video_stream.get('pix_fmt') if video_stream else None,
+            "audio_codec": audio_stream.get('codec_name') if audio_stream else None,
+            "audio_tracks": audio_tracks
         }
     except Exception as e:
         print(f"Error probing {file_path}: {e}")
         return None
 
-def build_ffmpeg_cmd_force_sync_av(movie_path, preset, metadata, sub_path=None):
+def resolve_start_time(start_time, keyframes=None):
+    """Snap a requested start position to the preceding source keyframe."""
+    if not start_time:
+        return 0
+    if keyframes is not None and len(keyframes):
+        return keyframes.snap(float(start_time))
+    return float(start_time)
+
+
+def keyframe_args(keyframes, start, duration, hls_time):
+    """Force output keyframes where the source has them, one per segment.
+
+    The muxer can only cut a segment on a keyframe, so this makes segments
+    start on the same frames as the source's GOPs.
+    """
+    if keyframes is None or not len(keyframes):
+        return []
+    end = start + duration if duration else None
+    times = [t - start for t in keyframes.boundaries(hls_time, start)
+             if t > start and (end is None or t < end)]
+    if not times:
+        return []
+    return ["-force_key_frames", ",".join(f"{t:.3f}" for t in times)]
+
+
+def subtitle_filter(sub_filter, start_time):
+    """Shift timestamps around a subtitles filter so burned subs match a seeked input."""
+    if not start_time:
+        return sub_filter
+    return f"setpts=PTS+{start_time}/TB,{sub_filter},setpts=PTS-STARTPTS"
+
+
+def input_seek_args(start, duration=None):
+    """Input-side -ss/-t for restarts and ranged (parallel) encodes."""
+    args = []
+    if start:
+        args += ["-ss", f"{start:.3f}"]
+    if duration:
+        args += ["-t", f"{duration:.3f}"]
+    return args
+
+
+def cmaf_output_args(hls_time=6, output_url=None, name_prefix="", ts_offset=None, resume=False):
+    """HLS/CMAF muxer arguments.
+
+    Files are written relative to the working directory, or PUT to
+    `output_url` when segments are kept in the in-memory store.
+    `name_prefix` and `ts_offset` are used by ranged encodes so several
+    FFmpeg processes can write one continuous timeline side by side.
+    `resume` appends to an existing playlist instead of starting over.
+    """
+    init_file = f"{name_prefix}init.mp4"
+    segment_file = f"{name_prefix}chunk_%d.m4s"
+    playlist_file = f"{name_prefix}index.m3u8"
+
+    args = []
+    if ts_offset:
+        args += ["-output_ts_offset", f"{ts_offset:.3f}"]
+    args += [
+        "-f", "hls",
+        "-hls_playlist_type", "event",
+        "-hls_flags", "independent_segments+omit_endlist" + ("+append_list" if resume else ""),
+        "-hls_segment_type", "fmp4",
+        "-hls_time", str(hls_time),
+        "-hls_list_size", "0",
+        "-hls_fmp4_init_filename", init_file,
+    ]
+    if output_url:
+        args += [
+            "-method", "PUT",
+            "-hls_segment_filename", f"{output_url}/{segment_file}",
+            f"{output_url}/{playlist_file}"
+        ]
+    else:
+        args += ["-hls_segment_filename", segment_file, playlist_file]
+    return args
+
+
+def build_ffmpeg_cmd_force_sync_av(movie_path, preset, metadata, sub_path=None,
+                                   keyframes=None, start_time=None, output_url=None,
+                                   duration=None, ts_offset=None, name_prefix="", resume=False,
+                                   audio=True):
     """MKV-specific handling with forced A/V sync fixes."""
     
     hls_native = Path(HLS_DIR)
     hls_native.mkdir(parents=True, exist_ok=True)
     
-    init_file = "init.mp4"
-    segment_file = "chunk_%d.m4s"
-    playlist_file = "index.m3u8"
-    
     cmd = ["ffmpeg", "-y"]
     
     # MKV-specific input flags
@@ -69,6 +174,8 @@ def build_ffmpeg_cmd_force_sync_av(movie_path, preset, metadata, sub_path=None):
         "-thread_queue_size", "512",
     ]
     
+    start = resolve_start_time(start_time, keyframes)
+    cmd += input_seek_args(start, duration)
     cmd += ["-i", movie_path]
     
     # Sync and timing fixes
@@ -79,19 +186,21 @@ def build_ffmpeg_cmd_force_sync_av(movie_path, preset, metadata, sub_path=None):
     ]
     
     # Explicit stream mapping
-    cmd += ["-map", "0:v:0", "-map", "0:a:0"]
+    cmd += ["-map", "0:v:0"]
+    if audio:
+        cmd += ["-map", "0:a:0"]
 
     # Filter logic with timestamp normalization
     base_vf = "setpts=PTS-STARTPTS,format=yuv420p"
     
     if sub_path and sub_path != "":
         esc_sub = escape_path_for_ffmpeg(sub_path)
-        filter_str = f"subtitles='{esc_sub}',{base_vf}"
+        filter_str = subtitle_filter(f"subtitles='{esc_sub}'", start) + f",{base_vf}"
         cmd += ["-vf", filter_str]
     elif metadata.get('text_sub_index') is not None:
         esc_path = escape_path_for_ffmpeg(movie_path)
         idx = metadata.get('text_sub_index')
-        filter_str = f"subtitles='{esc_path}':si={idx},{base_vf}"
+        filter_str = subtitle_filter(f"subtitles='{esc_path}':si={idx}", start) + f",{base_vf}"
         cmd += ["-vf", filter_str]
     elif metadata.get('pgs_sub_index') is not None:
         idx = metadata.get('pgs_sub_index')
@@ -99,63 +208,73 @@ def build_ffmpeg_cmd_force_sync_av(movie_path, preset, metadata, sub_path=None):
     else:
         cmd += ["-vf", base_vf]
 
-    # Video encoding
+    # Video encoding, cutting segments on the source's keyframes when known
+    hls_time = keyframes.segment_duration() if keyframes is not None else 6
     cmd += ["-c:v", preset['v_codec']] + preset['v_profile']
     cmd += [
         "-g", "48",
         "-keyint_min", "48",
         "-sc_threshold", "0",
     ]
+    cmd += keyframe_args(keyframes, start, duration, hls_time)
 
     # Audio encoding with sync
-    cmd += [
-        "-c:a", preset['a_codec'],
-        "-b:a", "192k",
-        "-ac", "2",
-        "-af", "aresample=async=1:min_hard_comp=0.100000:first_pts=0",
-    ]
+    if audio:
+        cmd += [
+            "-c:a", preset['a_codec'],
+            "-b:a", "192k",
+            "-ac", "2",
+            "-af", "aresample=async=1:min_hard_comp=0.100000:first_pts=0",
+        ]
 
-    # CMAF output
-    cmd += [
-        "-f", "hls",
-        "-hls_playlist_type", "event",
-        "-hls_flags", "independent_segments+omit_endlist",
-        "-hls_segment_type", "fmp4",
-        "-hls_time", "6",
-        "-hls_list_size", "0",
-        "-hls_fmp4_init_filename", init_file,
-        "-hls_segment_filename", segment_file,
-        playlist_file
-    ]
+    # CMAF output, segment length aligned to the source GOP when known
+    cmd += cmaf_output_args(hls_time, output_url, name_prefix, ts_offset, resume)
     
     return cmd, str(hls_native)
 
-def build_ffmpeg_command(movie_path, preset, metadata, sub_path=None, force_sync=False):
-    """Build the FFmpeg command for CMAF streaming."""
+def build_ffmpeg_command(movie_path, preset, metadata, sub_path=None, force_sync=False,
+                         keyframes=None, start_time=None, output_url=None,
+                         duration=None, ts_offset=None, name_prefix="", resume=False,
+                         audio=True):
+    """Build the FFmpeg command for CMAF streaming.
+
+    `keyframes` is an optional KeyframeIndex for the source; when given,
+    `start_time` is snapped to a real keyframe, segment length follows
+    the source GOP and segments are cut on the source's keyframes. `output_url` sends the output to the in-memory
+    segment store's ingest server instead of HLS_DIR. `duration`,
+    `ts_offset` and `name_prefix` encode a single range of the source
+    (see utils.parallel). `resume` continues a partially written
+    playlist (see utils.pretranscode). With `audio` False only video is
+    encoded and the audio tracks are served as separate renditions (see
+    utils.renditions).
+    """
     
     # Route to force sync handler when flag is set
     if force_sync:
-        return build_ffmpeg_cmd_force_sync_av(movie_path, preset, metadata, sub_path)
+        return build_ffmpeg_cmd_force_sync_av(movie_path, preset, metadata, sub_path,
+                                              keyframes=keyframes, start_time=start_time,
+                                              output_url=output_url, duration=duration,
+                                              ts_offset=ts_offset, name_prefix=name_prefix,
+                                              resume=resume, audio=audio)
     
     # Original logic for all other cases (completely unchanged)
     hls_native = Path(HLS_DIR)
     hls_native.mkdir(parents=True, exist_ok=True)
     
-    init_file = "init.mp4"
-    segment_file = "chunk_%d.m4s"
-    playlist_file = "index.m3u8"
-    
-    cmd = ["ffmpeg", "-y", "-i", movie_path]
+    cmd = ["ffmpeg", "-y"]
+    start = resolve_start_time(start_time, keyframes)
+    cmd += input_seek_args(start, duration)
+    cmd += ["-i", movie_path]
 
     # Filter Logic
     if sub_path and sub_path != "":
         esc_sub = escape_path_for_ffmpeg(sub_path)
-        filter_str = f"subtitles='{esc_sub}',format=yuv420p"
+        filter_str = subtitle_filter(f"subtitles='{esc_sub}'", start) + ",format=yuv420p"
         cmd += ["-vf", filter_str]
     elif metadata.get('text_sub_index') is not None:
         esc_path = escape_path_for_ffmpeg(movie_path)
         idx = metadata.get('text_sub_index')
-        filter_str = f"subtitles='{esc_path}':si={idx},format=yuv420p"
+        filter_str = subtitle_filter(f"subtitles='{esc_path}':si={idx}", start) + ",format=yuv420p"
         cmd += ["-vf", filter_str]
     elif metadata.get('pgs_sub_index') is not None:
         idx = metadata.get('pgs_sub_index')
@@ -163,30 +282,69 @@ def build_ffmpeg_command(movie_path, preset, metadata, sub_path=None, force_sync
     else:
         cmd += ["-vf", "format=yuv420p"]
 
-    # Video/audio encoding
+    # Video/audio encoding, cutting segments on the source's keyframes when known
+    hls_time = keyframes.segment_duration() if keyframes is not None else 6
     cmd += ["-c:v", preset['v_codec']] + preset['v_profile']
-    cmd += ["-c:a", preset['a_codec'], "-b:a", "192k", "-ac", "2"]
+    cmd += keyframe_args(keyframes, start, duration, hls_time)
+    if audio:
+        cmd += ["-c:a", preset['a_codec'], "-b:a", "192k", "-ac", "2"]
+    else:
+        cmd += ["-an"]
 
-    # CMAF settings with relative paths
-    cmd += [
-        "-f", "hls",
-        "-hls_playlist_type", "event",
-        "-hls_flags", "independent_segments+omit_endlist",
-        "-hls_segment_type", "fmp4",
-        "-hls_time", "6",
-        "-hls_list_size", "0",
-        "-hls_fmp4_init_filename", init_file,
-        "-hls_segment_filename", segment_file,
-        playlist_file
-    ]
+    # CMAF settings with relative paths (or ingest URLs in memory mode)
+    cmd += cmaf_output_args(hls_time, output_url, name_prefix, ts_offset, resume)
     
     return cmd, str(hls_native)
 
-def cleanup_hls_directory():
+def build_audio_command(movie_path, preset, track, force_sync=False, keyframes=None,
+                        start_time=None, output_url=None, ts_offset=None, name_prefix=""):
+    """Build the FFmpeg command for one audio-only CMAF rendition.
+
+    `track` is the index among the source's audio streams. `start_time` and
+    `keyframes` must match the video encode so both timelines begin at the
+    same source position. `ts_offset` starts the audio that many seconds
+    into the video's timeline (see utils.renditions).
+    """
+    cmd = ["ffmpeg", "-y"]
+    if force_sync:
+        cmd += ["-fflags", "+genpts"]
+    start = resolve_start_time(start_time, keyframes) + (ts_offset or 0)
+    cmd += input_seek_args(start)
+    cmd += ["-i", movie_path]
+    cmd += ["-map", f"0:a:{track}", "-vn"]
+    cmd += ["-c:a", preset['a_codec'], "-b:a", "192k", "-ac", "2"]
+    if force_sync:
+        cmd += ["-af", "aresample=async=1:min_hard_comp=0.100000:first_pts=0"]
+
+    hls_time = keyframes.segment_duration() if keyframes is not None else 6
+    cmd += cmaf_output_args(hls_time, output_url, name_prefix, ts_offset)
+    return cmd, str(HLS_DIR)
+
+def cleanup_stale_jobs(directory=HLS_DIR, keep=()):
+    """Remove per-job output folders left behind by a crash or restart.
+
+    Job folders are named by job id (see models.job_id_for); folders in
+    `keep` (pre-transcoded library, trickplay cache) are left alone.
+    """
+    root = Path(directory)
+    if not root.exists():
+        return
+    keep = {Path(k).resolve() for k in keep}
+    for d in root.iterdir():
+        if not d.is_dir() or not re.fullmatch(r'[0-9a-f]{12}', d.name):
+            continue
+        path = d.resolve()
+        if any(path == k or path in k.parents for k in keep):
+            continue
+        shutil.rmtree(d, ignore_errors=True)
+    cleanup_hls_directory(root)
+
+
+def cleanup_hls_directory(directory=HLS_DIR):
     """Remove old CMAF segments and playlist files."""
     extensions = (".m4s", ".m3u8", ".mp4")
     
-    hls_dir_native = Path(HLS_DIR)
+    hls_dir_native = Path(directory)
     
     if not hls_dir_native.exists():
         return
@@ -196,4 +354,90 @@ def cleanup_hls_directory():
             try:
                 f.unlink()
             except:
-                pass
\ No newline at end of file
+                pass
+
+
+# stderr patterns that identify why FFmpeg died, checked in order
+FFMPEG_ERROR_PATTERNS = [
+    ("encoder_unavailable", re.compile(
+        r"Cannot load libnvidia-encode|No NVENC capable devices|OpenEncodeSessionEx failed|"
+        r"nvenc API version|Unknown encoder|Error while opening encoder|"
+        r"Could not open encoder|Error initializing output stream", re.I)),
+    ("subtitle_filter", re.compile(
+        r"Error initializing filter 'subtitles'|Unable to open .*\.(srt|ass|ssa)|"
+        r"Unable to parse option value .*subtitles|Parsed_subtitles", re.I)),
+    ("unsupported_input", re.compile(
+        r"Invalid data found when processing input|No such file or directory|"
+        r"could not find codec parameters|Decoder .* not found|moov atom not found", re.I)),
+]
+
+
+def classify_ffmpeg_error(stderr_text):
+    """Map FFmpeg's stderr to a failure category and the most relevant line."""
+    lines = [l.strip() for l in stderr_text.splitlines() if l.strip()]
+    for category, pattern in FFMPEG_ERROR_PATTERNS:
+        for line in lines:
+            if pattern.search(line):
+                return {"error": category, "message": line}
+    return {"error": "unknown", "message": lines[-1] if lines else "ffmpeg exited"}
+
+
+class FFmpegProcess(subprocess.Popen):
+    """Popen that tees FFmpeg's stderr to the console and keeps the tail for diagnosis."""
+
+    def __init__(self, cmd, **kwargs):
+        super().__init__(cmd, stderr=subprocess.PIPE, **kwargs)
+        self.stderr_tail = deque(maxlen=50)
+        self.encoding = threading.Event()
+        self.stderr_closed = threading.Event()
+        threading.Thread(target=self._pump_stderr, daemon=True).start()
+
+    def _pump_stderr(self):
+        buf = b''
+        console = True
+        try:
+            while True:
+                chunk = os.read(self.stderr.fileno(), 4096)
+                if not chunk:
+                    break
+                if console:
+                    try:
+                        sys.stderr.buffer.write(chunk)
+                        sys.stderr.flush()
+                    except (OSError, ValueError, AttributeError):
+                        # No console (closed pipe, pythonw): keep draining the
+                        # pipe anyway, or FFmpeg blocks once it fills up
+                        console = False
+                buf += chunk
+                # Progress lines end in \r, everything else in \n
+                *lines, buf = re.split(rb'[\r\n]', buf)
+                for line in lines:
+                    text = line.decode('utf-8', 'replace')
+                    if text.startswith('frame=') or text.startswith('size='):
+                        self.encoding.set()
+                    elif text:
+                        self.stderr_tail.append(text)
+        except (OSError, ValueError):
+            pass
+        finally:
+            if buf:
+                self.stderr_tail.append(buf.decode('utf-8', 'replace'))
+            self.stderr_closed.set()
+
+    def wait_for_startup(self, timeout):
+        """Watch the first `timeout` seconds of the process.
+
+        Returns None once FFmpeg reports encoding progress (or is still
+        running at the deadline), otherwise the classified failure.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.encoding.wait(0.05):
+                return None
+            if self.poll() is not None:
+                break
+        if self.poll() is None or self.returncode == 0:
+            return None
+        self.stderr_closed.wait(0.5)
+        return classify_ffmpeg_error("\n".join(self.stderr_tail))
+
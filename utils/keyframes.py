@@ -0,0 +1,207 @@
+"""Background keyframe indexing for media files."""
+
+import os
+import queue
+import subprocess
+import threading
+from array import array
+from bisect import bisect_right
+
+
+def file_identity(file_path):
+    """Return a key that changes whenever the file on disk changes."""
+    st = os.stat(file_path)
+    return (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+
+
+class KeyframeIndex:
+    """Keyframe timestamps (seconds) and byte offsets for one video stream.
+
+    Times are relative to the container's start time, the same origin that
+    FFmpeg's input -ss and the output timeline use.
+    """
+
+    def __init__(self, times, offsets):
+        self.times = times
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.times)
+
+    def snap(self, seconds):
+        """Return the last keyframe time at or before `seconds`."""
+        i = bisect_right(self.times, seconds) - 1
+        if i < 0:
+            return 0.0
+        return self.times[i]
+
+    def boundaries(self, target, start=None):
+        """Return keyframe times spaced at least `target` seconds apart.
+
+        Counting starts at the keyframe at or before `start` when given,
+        otherwise at the first keyframe.
+        """
+        result = []
+        last = None
+        first = 0 if start is None else max(0, bisect_right(self.times, start) - 1)
+        for t in self.times[first:]:
+            if last is None or t - last >= target:
+                result.append(t)
+                last = t
+        return result
+
+    def segment_duration(self, target=6):
+        """Pick an -hls_time that is a whole number of source GOPs, at most `target`.
+
+        Sources with GOPs longer than `target` get `target` itself: the
+        encoder places its own keyframes, so long segments would only delay
+        the first one.
+        """
+        if len(self.times) < 2:
+            return target
+        gaps = sorted(b - a for a, b in zip(self.times, self.times[1:]) if b > a)
+        if not gaps:
+            return target
+        gop = gaps[len(gaps) // 2]
+        if gop >= target:
+            return target
+        return round(gop * max(1, int(target // gop)), 3)
+
+
+def scan_keyframes(file_path):
+    """Scan video packets with ffprobe and collect keyframe positions."""
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,pos,flags:format=start_time',
+        '-of', 'csv',
+        file_path
+    ]
+    times = array('d')
+    offsets = array('q')
+    origin = 0.0
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        for raw in proc.stdout:
+            fields = raw.decode('utf-8', 'replace').strip().split(',')
+            if fields[0] == 'format' and len(fields) > 1:
+                try:
+                    origin = float(fields[1])
+                except ValueError:
+                    pass
+                continue
+            if fields[0] != 'packet' or len(fields) < 4 or 'K' not in fields[3]:
+                continue
+            try:
+                t = float(fields[1])
+            except ValueError:
+                continue
+            try:
+                pos = int(fields[2])
+            except ValueError:
+                pos = -1
+            times.append(t)
+            offsets.append(pos)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffprobe exited with code {proc.returncode}")
+
+    # Packet timestamps count from the container's first PTS, -ss from zero
+    if origin:
+        times = array('d', (t - origin for t in times))
+
+    # Packets come out in decode order; keyframes must be sorted by pts.
+    if any(b < a for a, b in zip(times, times[1:])):
+        pairs = sorted(zip(times, offsets))
+        times = array('d', (p[0] for p in pairs))
+        offsets = array('q', (p[1] for p in pairs))
+    return KeyframeIndex(times, offsets)
+
+
+class KeyframeIndexer:
+    """Indexes files on a background thread and caches results per file identity."""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._cache = {}
+        # key -> Event set when a queued scan finishes
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def request(self, file_path):
+        """Queue `file_path` for indexing if it is not cached already."""
+        try:
+            key = file_identity(file_path)
+        except OSError:
+            return
+        with self._lock:
+            if key in self._cache or key in self._pending:
+                return
+            self._pending[key] = threading.Event()
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        self._queue.put((key, file_path))
+
+    def get(self, file_path):
+        """Return the cached KeyframeIndex for `file_path`, or None if not ready."""
+        try:
+            key = file_identity(file_path)
+        except OSError:
+            return None
+        with self._lock:
+            index = self._cache.pop(key, None)
+            if index is not None:
+                # Re-insert to keep most recently used entries at the end
+                self._cache[key] = index
+            return index
+
+    def wait(self, file_path, timeout=None):
+        """Return the KeyframeIndex for `file_path`, waiting up to `timeout` for the background scan.
+
+        Returns None if the scan is not finished in time (or failed).
+        """
+        index = self.get(file_path)
+        if index is not None:
+            return index
+        self.request(file_path)
+        try:
+            key = file_identity(file_path)
+        except OSError:
+            return None
+        with self._lock:
+            event = self._pending.get(key)
+        if event is not None:
+            event.wait(timeout)
+        return self.get(file_path)
+
+    def _store(self, key, index):
+        with self._lock:
+            event = self._pending.pop(key, None)
+            if event is not None:
+                event.set()
+            if index is None:
+                return
+            self._cache[key] = index
+            while len(self._cache) > self.max_entries:
+                self._cache.pop(next(iter(self._cache)))
+
+    def _run(self):
+        while True:
+            key, file_path = self._queue.get()
+            index = None
+            try:
+                index = scan_keyframes(file_path)
+            except Exception as e:
+                print(f"Error indexing keyframes for {file_path}: {e}")
+            self._store(key, index)
+
+
+# Global instance - imported where needed
+keyframe_indexer = KeyframeIndexer()
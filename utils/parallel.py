@@ -0,0 +1,288 @@
+"""Parallel chunked transcoding: keyframe-aligned ranges encoded by a pool of FFmpeg workers."""
+
+import math
+import os
+import re
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from utils.ffmpeg import build_ffmpeg_command, FFmpegProcess
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+_RANGE_RE = re.compile(r'^r(\d+)_')
+
+
+def range_prefix(idx):
+    return f"r{idx:04d}_"
+
+
+def range_of(name):
+    """Return the range index encoded in a segment name, or None."""
+    m = _RANGE_RE.match(name)
+    return int(m.group(1)) if m else None
+
+
+def split_ranges(keyframes, start_time=0, range_seconds=120, min_seconds=None):
+    """Split the source into (start, end) ranges that begin on keyframes.
+
+    The final range has end None and runs to the end of the file. A range
+    shorter than `min_seconds` (default a quarter of `range_seconds`) is
+    merged into the next one, so starting just before a boundary does not
+    spend a whole FFmpeg launch on a second or two of video.
+    """
+    if min_seconds is None:
+        min_seconds = range_seconds / 4
+    starts = [keyframes.snap(start_time)]
+    for t in keyframes.boundaries(range_seconds):
+        if t - starts[-1] >= min_seconds:
+            starts.append(t)
+    return [(s, e) for s, e in zip(starts, starts[1:] + [None])]
+
+
+def playlist_seconds(text):
+    """Sum the segment durations listed in a media playlist."""
+    return sum(float(line[8:].split(',')[0]) for line in (text or '').splitlines()
+               if line.startswith('#EXTINF:'))
+
+
+def stitch_playlists(parts, hls_time=6):
+    """Join media playlists of consecutive ranges into one EVENT playlist.
+
+    `parts` yields (playlist text or None, finished) in timeline order.
+    Stops at the first range that is missing or still being written, and
+    adds ENDLIST only when every range has finished.
+    """
+    lines = []
+    target = math.ceil(hls_time)
+    complete = True
+    for text, finished in parts:
+        if text is None:
+            complete = False
+            break
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith('#EXT-X-MAP') or line.startswith('#EXTINF') or \
+                    (line and not line.startswith('#')):
+                lines.append(line)
+            if line.startswith('#EXTINF'):
+                target = max(target, math.ceil(float(line[8:].split(',')[0])))
+        if not finished:
+            complete = False
+            break
+
+    header = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:7",
+        f"#EXT-X-TARGETDURATION:{target}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:EVENT",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+    ]
+    footer = ["#EXT-X-ENDLIST"] if complete else []
+    return "\n".join(header + lines + footer) + "\n"
+
+
+class TranscodeRange:
+    """One keyframe-aligned slice of the source and the worker encoding it."""
+
+    def __init__(self, idx, start, end):
+        self.idx = idx
+        self.start = start
+        self.end = end
+        self.state = PENDING
+        self.process = None
+        self.attempts = 0
+
+    @property
+    def prefix(self):
+        return range_prefix(self.idx)
+
+
+class ParallelTranscode:
+    """Runs ranged encodes concurrently and stitches them into one CMAF playlist.
+
+    Quacks like subprocess.Popen (poll/terminate) so it can stand in for
+    the FFmpeg process of a StreamJob. Pending ranges are started in order of
+    distance ahead of the playhead, which moves as clients fetch segments.
+    """
+
+    def __init__(self, movie_path, preset, metadata, keyframes, sub_path=None,
+                 force_sync=False, start_time=0, workers=2, range_seconds=120,
+                 output_dir=None, output_url=None, store=None, store_prefix="",
+                 max_attempts=2, audio=True):
+        self.movie_path = movie_path
+        self.preset = preset
+        self.metadata = metadata
+        self.keyframes = keyframes
+        self.sub_path = sub_path
+        self.force_sync = force_sync
+        self.workers = max(1, workers)
+        self.output_dir = output_dir
+        self.output_url = output_url
+        self.store = store
+        self.store_prefix = store_prefix
+        self.max_attempts = max_attempts
+        self.audio = audio
+        self.hls_time = keyframes.segment_duration()
+        spans = split_ranges(keyframes, start_time or 0, range_seconds)
+        self.origin = spans[0][0]
+        self.ranges = [TranscodeRange(i, s, e) for i, (s, e) in enumerate(spans)]
+        self.playhead = 0
+        self.returncode = None
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._first = None
+
+    def start(self):
+        """Launch the first ranges right away, then keep the pool busy in the background."""
+        with self._lock:
+            self._launch()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def wait_for_startup(self, timeout, stop_timeout=10):
+        """Watch the first range's encoder like FFmpegProcess.wait_for_startup.
+
+        On failure every range is stopped, so the caller can retry the
+        whole transcode with a fallback preset.
+        """
+        failure = self._first.wait_for_startup(timeout)
+        if failure is not None:
+            self.terminate()
+            try:
+                self.wait(stop_timeout)
+            except subprocess.TimeoutExpired:
+                pass
+        return failure
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        """Wait for every range process to exit and the stitcher to stop."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                raise subprocess.TimeoutExpired(self.movie_path, timeout)
+        return self.returncode
+
+    def terminate(self):
+        with self._lock:
+            self._stopped = True
+            for r in self.ranges:
+                if r.state == PENDING:
+                    r.state = FAILED
+                elif r.process and r.process.poll() is None:
+                    r.process.terminate()
+
+    def note_fetch(self, name):
+        """Move the playhead to the range a client just fetched from."""
+        idx = range_of(name.rpartition('/')[2])
+        if idx is not None:
+            with self._lock:
+                self.playhead = idx
+
+    def build_range_command(self, r):
+        duration = r.end - r.start if r.end is not None else None
+        cmd, work_dir = build_ffmpeg_command(
+            self.movie_path,
+            self.preset,
+            self.metadata,
+            self.sub_path,
+            force_sync=self.force_sync,
+            keyframes=self.keyframes,
+            start_time=r.start,
+            output_url=self.output_url,
+            duration=duration,
+            ts_offset=r.start - self.origin,
+            name_prefix=r.prefix,
+            audio=self.audio
+        )
+        return cmd, work_dir
+
+    def _next_range(self):
+        pending = [r for r in self.ranges if r.state == PENDING]
+        if not pending:
+            return None
+        # Ranges at or after the playhead first (nearest first), then earlier ones
+        return min(pending, key=lambda r: (r.idx < self.playhead, abs(r.idx - self.playhead)))
+
+    def _reap(self):
+        for r in self.ranges:
+            if r.state != RUNNING or r.process.poll() is None:
+                continue
+            if r.process.returncode == 0:
+                r.state = DONE
+            elif self._stopped:
+                r.state = FAILED
+            elif r.attempts < self.max_attempts:
+                print(f"Range {r.idx} exited with code {r.process.returncode}, retrying")
+                r.state = PENDING
+            else:
+                print(f"Range {r.idx} failed after {r.attempts} attempts")
+                r.state = FAILED
+
+    def _launch(self):
+        running = sum(1 for r in self.ranges if r.state == RUNNING)
+        while running < self.workers:
+            r = self._next_range()
+            if r is None:
+                return
+            cmd, _ = self.build_range_command(r)
+            r.attempts += 1
+            r.process = FFmpegProcess(cmd, cwd=self.output_dir)
+            if self._first is None:
+                self._first = r.process
+            r.state = RUNNING
+            running += 1
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._reap()
+                if not self._stopped:
+                    self._launch()
+                finished = all(r.state in (DONE, FAILED) for r in self.ranges)
+                stopped = self._stopped
+            if not stopped:
+                # Once stopped the output folder is about to be removed
+                self.write_playlist()
+            if finished:
+                failed = any(r.state == FAILED for r in self.ranges)
+                self.returncode = 1 if failed else 0
+                return
+            time.sleep(0.5)
+
+    def _read(self, name):
+        if self.store is not None:
+            data = self.store.get(self.store_prefix + name)
+            return data.decode('utf-8', 'replace') if data is not None else None
+        try:
+            return (Path(self.output_dir) / name).read_text()
+        except OSError:
+            return None
+
+    def _write(self, name, text):
+        if self.store is not None:
+            self.store.put(self.store_prefix + name, text.encode('utf-8'))
+            return
+        path = Path(self.output_dir) / name
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(text)
+        os.replace(tmp, path)
+
+    def stitch(self):
+        """Concatenate the per-range playlists that form a contiguous prefix."""
+        parts = ((self._read(f"{r.prefix}index.m3u8"), r.state == DONE) for r in self.ranges)
+        return stitch_playlists(parts, self.hls_time)
+
+    def write_playlist(self):
+        try:
+            self._write("index.m3u8", self.stitch())
+        except Exception as e:
+            print(f"Error writing stitched playlist: {e}")
@@ -0,0 +1,356 @@
+"""Persistent library pre-transcode queue.
+
+Jobs live in a JSON file under PRETRANSCODE_DIR so the queue survives
+restarts. Each job transcodes one (file, preset) pair into its own output
+directory using the normal command builder. Interrupted jobs resume from the
+last complete segment via -ss and the HLS muxer's append_list flag.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from config import (PRESETS, VIDEO_EXTENSIONS, LIBRARY_PATH, PRETRANSCODE_DIR,
+                    PRETRANSCODE_WORKERS, PRETRANSCODE_WINDOW)
+from utils.ffmpeg import get_video_metadata, build_ffmpeg_command
+from utils.keyframes import file_identity
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+HEARTBEAT_TIMEOUT = 60
+LOCK_TIMEOUT = 10
+
+
+def job_id_for(file_path, preset_key):
+    """Stable id for a (file version, preset) pair."""
+    path, size, mtime = file_identity(file_path)
+    key = f"{path}|{size}|{mtime}|{preset_key}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def parse_window(window):
+    """Parse "HH:MM-HH:MM" into ((h, m), (h, m)), or None for no limit."""
+    if not window:
+        return None
+    start, end = window.split('-')
+    sh, sm = (int(x) for x in start.strip().split(':'))
+    eh, em = (int(x) for x in end.strip().split(':'))
+    return (sh, sm), (eh, em)
+
+
+def in_window(window, now=None):
+    """True if `now` falls inside the (possibly overnight) window."""
+    if window is None:
+        return True
+    now = now or datetime.now()
+    current = (now.hour, now.minute)
+    start, end = window
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+def completed_seconds(playlist_path):
+    """Sum the durations of segments already listed in a playlist."""
+    try:
+        text = Path(playlist_path).read_text()
+    except OSError:
+        return 0.0
+    total = 0.0
+    for line in text.splitlines():
+        if line.startswith('#EXTINF:'):
+            total += float(line[8:].split(',')[0])
+    return total
+
+
+class PretranscodeQueue:
+    """Durable job queue plus the runner that works through it."""
+
+    def __init__(self, root=PRETRANSCODE_DIR, workers=PRETRANSCODE_WORKERS,
+                 window=PRETRANSCODE_WINDOW):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.queue_file = self.root / 'queue.json'
+        self.lock_file = self.root / 'queue.lock'
+        self.workers = max(1, workers)
+        self.window = parse_window(window)
+        self.runner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._processes = {}
+        self._progress = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    # -- persistence -------------------------------------------------------
+
+    @contextmanager
+    def _locked(self):
+        """Load the queue under a cross-process lock and save it on exit."""
+        with self._lock:
+            deadline = time.time() + LOCK_TIMEOUT
+            while True:
+                try:
+                    fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                    os.close(fd)
+                    break
+                except FileExistsError:
+                    # A lock left behind by a crashed process goes stale
+                    try:
+                        if time.time() - self.lock_file.stat().st_mtime > LOCK_TIMEOUT:
+                            self.lock_file.unlink()
+                            continue
+                    except OSError:
+                        continue
+                    if time.time() > deadline:
+                        raise TimeoutError(f"Could not lock {self.queue_file}")
+                    time.sleep(0.05)
+            try:
+                jobs = self._load()
+                yield jobs
+                self._save(jobs)
+            finally:
+                try:
+                    self.lock_file.unlink()
+                except OSError:
+                    pass
+
+    def _load(self):
+        if not self.queue_file.exists():
+            return {}
+        try:
+            with open(self.queue_file) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading {self.queue_file}: {e}")
+            return {}
+
+    def _save(self, jobs):
+        tmp = self.queue_file.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(jobs, f, indent=2)
+        os.replace(tmp, self.queue_file)
+
+    # -- queue management --------------------------------------------------
+
+    def output_dir(self, job_id):
+        return self.root / job_id
+
+    def add(self, file_path, preset_key='cpu_fast'):
+        """Queue one file; returns the job. Finished jobs are left alone."""
+        if preset_key not in PRESETS:
+            raise ValueError(f"Unknown preset: {preset_key}")
+        job_id = job_id_for(file_path, preset_key)
+        now = time.time()
+        with self._locked() as jobs:
+            job = jobs.get(job_id)
+            if job is None:
+                job = {
+                    "id": job_id,
+                    "path": str(file_path),
+                    "preset": preset_key,
+                    "status": QUEUED,
+                    "progress": 0.0,
+                    "duration": None,
+                    "error": None,
+                    "added": now,
+                    "updated": now,
+                    "owner": None,
+                    "heartbeat": None,
+                }
+                jobs[job_id] = job
+            elif job['status'] in (FAILED, CANCELLED):
+                job.update(status=QUEUED, error=None, owner=None, updated=now)
+            return dict(job)
+
+    def add_folder(self, folder, preset_key='cpu_fast'):
+        """Queue every video file under `folder`."""
+        added = []
+        for root, dirs, files in os.walk(folder):
+            for f in sorted(files):
+                if f.lower().endswith(VIDEO_EXTENSIONS):
+                    added.append(self.add(os.path.join(root, f), preset_key))
+        return added
+
+    def add_library(self, preset_key='cpu_fast'):
+        return self.add_folder(LIBRARY_PATH, preset_key)
+
+    def cancel(self, job_id):
+        with self._locked() as jobs:
+            job = jobs.get(job_id)
+            if job is None or job['status'] == DONE:
+                return False
+            job.update(status=CANCELLED, updated=time.time())
+            return True
+
+    def remove(self, job_id):
+        """Drop a job and its output."""
+        with self._locked() as jobs:
+            job = jobs.pop(job_id, None)
+        if job is None:
+            return False
+        shutil.rmtree(self.output_dir(job_id), ignore_errors=True)
+        return True
+
+    def jobs(self):
+        with self._lock:
+            jobs = self._load()
+        return sorted(jobs.values(), key=lambda j: j['added'])
+
+    def find_output(self, file_path, preset_key):
+        """Return the output directory of a finished job for this file, or None."""
+        try:
+            job_id = job_id_for(file_path, preset_key)
+        except OSError:
+            return None
+        with self._lock:
+            job = self._load().get(job_id)
+        if job is None or job['status'] != DONE:
+            return None
+        out = self.output_dir(job_id)
+        return str(out) if (out / 'index.m3u8').exists() else None
+
+    # -- runner ------------------------------------------------------------
+
+    def start(self):
+        """Run the queue on a background thread."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self.run_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def run_forever(self, interval=2):
+        try:
+            while not self._stopping:
+                try:
+                    self.tick()
+                except Exception as e:
+                    print(f"Pre-transcode runner error: {e}")
+                time.sleep(interval)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop running encodes; they are requeued and resume next time."""
+        self._stopping = True
+        with self._locked() as jobs:
+            for job_id, proc in list(self._processes.items()):
+                proc.terminate()
+                proc.wait()
+                job = jobs.get(job_id)
+                if job and job['status'] == RUNNING:
+                    job.update(status=QUEUED, owner=None, updated=time.time())
+            self._processes.clear()
+
+    def tick(self):
+        now = time.time()
+        open_now = in_window(self.window)
+        to_launch = []
+        with self._locked() as jobs:
+            # Reap finished encodes and stop ones that were cancelled
+            for job_id, proc in list(self._processes.items()):
+                job = jobs.get(job_id)
+                if job is None or job['status'] == CANCELLED or not open_now:
+                    proc.terminate()
+                    proc.wait()
+                    del self._processes[job_id]
+                    if job is not None and job['status'] == RUNNING:
+                        job.update(status=QUEUED, owner=None)
+                    continue
+                done = self._progress.get(job_id)
+                if done is not None and job.get('duration'):
+                    job['progress'] = round(min(1.0, done / job['duration']), 4)
+                job['heartbeat'] = now
+                if proc.poll() is None:
+                    continue
+                del self._processes[job_id]
+                if proc.returncode == 0:
+                    self._finalize(job_id)
+                    job.update(status=DONE, progress=1.0, owner=None)
+                else:
+                    job.update(status=FAILED, owner=None,
+                               error=f"ffmpeg exited with code {proc.returncode}")
+                job['updated'] = now
+
+            # Claim queued jobs, plus running jobs whose runner went away
+            if open_now:
+                free = self.workers - len(self._processes)
+                for job in sorted(jobs.values(), key=lambda j: j['added']):
+                    if free <= 0:
+                        break
+                    stale = (job['status'] == RUNNING and job['owner'] != self.runner_id and
+                             now - (job['heartbeat'] or 0) > HEARTBEAT_TIMEOUT)
+                    if job['status'] == QUEUED or stale:
+                        job.update(status=RUNNING, owner=self.runner_id, heartbeat=now, updated=now)
+                        to_launch.append(dict(job))
+                        free -= 1
+
+        for job in to_launch:
+            self._launch(job)
+
+    def _launch(self, job):
+        job_id = job['id']
+        try:
+            metadata = get_video_metadata(job['path'])
+            if metadata is None:
+                raise RuntimeError("could not probe file")
+            out = self.output_dir(job_id)
+            out.mkdir(parents=True, exist_ok=True)
+            resume_at = completed_seconds(out / 'index.m3u8')
+            cmd, _ = build_ffmpeg_command(
+                job['path'],
+                PRESETS[job['preset']],
+                metadata,
+                start_time=resume_at,
+                ts_offset=resume_at,
+                resume=resume_at > 0
+            )
+            cmd[1:1] = ["-nostats", "-progress", "pipe:1"]
+            log = open(out / 'ffmpeg.log', 'ab')
+            proc = subprocess.Popen(cmd, cwd=str(out), stdout=subprocess.PIPE, stderr=log)
+            log.close()
+        except Exception as e:
+            with self._locked() as jobs:
+                if job_id in jobs:
+                    jobs[job_id].update(status=FAILED, owner=None, error=str(e), updated=time.time())
+            return
+
+        with self._locked() as jobs:
+            if job_id in jobs:
+                jobs[job_id]['duration'] = metadata.get('duration')
+        self._progress[job_id] = resume_at
+        self._processes[job_id] = proc
+        threading.Thread(target=self._read_progress, args=(job_id, proc, resume_at),
+                         daemon=True).start()
+
+    def _read_progress(self, job_id, proc, resume_at):
+        for raw in proc.stdout:
+            line = raw.decode('utf-8', 'replace').strip()
+            if line.startswith('out_time_us=') or line.startswith('out_time_ms='):
+                try:
+                    seconds = int(line.split('=', 1)[1]) / 1_000_000
+                except ValueError:
+                    continue
+                self._progress[job_id] = max(resume_at, seconds)
+
+    def _finalize(self, job_id):
+        """Mark the playlist as complete so players treat it as VOD."""
+        playlist = self.output_dir(job_id) / 'index.m3u8'
+        try:
+            text = playlist.read_text()
+            if '#EXT-X-ENDLIST' not in text:
+                playlist.write_text(text.rstrip('\n') + '\n#EXT-X-ENDLIST\n')
+        except OSError as e:
+            print(f"Error finalizing {playlist}: {e}")
+
+
+# Global instance - imported where needed
+pretranscode_queue = PretranscodeQueue()
@@ -0,0 +1,274 @@
+"""Alternate audio renditions, transcoded only when a client selects them.
+
+Files with several audio tracks are encoded video-only. A master playlist
+lists each source audio track as a rendition in one HLS audio group. A
+rendition's FFmpeg process starts the first time a player asks for its
+playlist, so languages nobody picks are never encoded. Each rendition writes
+into its own audioN/ folder next to the video output; the folder also keeps
+memory-store eviction separate from the video segments.
+
+A track picked mid-film starts encoding a little before the client's
+playhead rather than at the start of the job. Its playlist then lists the
+earlier part of the video timeline as EXT-X-GAP segments, followed by the
+segments FFmpeg has written.
+
+Tracks whose encode fails are listed by failures(), which /api/ping reports
+so the player's language menu can mark them.
+"""
+
+import math
+import os
+import re
+import threading
+import uuid
+from pathlib import Path
+
+from utils.ffmpeg import build_audio_command, FFmpegProcess
+
+# Audio encoded before the playhead, so short seeks back still have sound
+LEAD_SECONDS = 30
+# Name prefix of a rendition that starts partway into the timeline
+OFFSET_PREFIX = "s_"
+
+_PLAYLIST_RE = re.compile(r'^audio(\d+)/index\.m3u8$')
+_VIDEO_SEGMENT_RE = re.compile(r'^(?:r\d+_)?chunk_\d+\.m4s$')
+
+
+def rendition_dir(track):
+    return f"audio{track}"
+
+
+def track_name(track):
+    """Label shown in the player's audio menu."""
+    label = track.get('title') or track.get('language') or f"Track {track['index'] + 1}"
+    if track.get('title') and track.get('language'):
+        label = f"{track['title']} ({track['language']})"
+    return label.replace('"', "'")
+
+
+def estimate_bandwidth(preset):
+    """Peak bits per second for the variant: the preset's video bitrate (or a CRF guess) plus audio."""
+    profile = preset.get('v_profile', [])
+    video = 8_000_000
+    if '-b:v' in profile:
+        value = profile[profile.index('-b:v') + 1]
+        scale = {'k': 1_000, 'M': 1_000_000}.get(value[-1], 1)
+        video = int(float(value.rstrip('kM')) * scale)
+    return video + 192_000
+
+
+def playlist_segments(text):
+    """(duration, uri) of each segment listed in a media playlist."""
+    segments = []
+    duration = None
+    for line in (text or '').splitlines():
+        line = line.strip()
+        if line.startswith('#EXTINF:'):
+            duration = float(line[8:].split(',')[0])
+        elif line and not line.startswith('#') and duration is not None:
+            segments.append((duration, line))
+            duration = None
+    return segments
+
+
+def gap_playlist(gaps, text):
+    """Rendition playlist: GAP segments of the given durations, then FFmpeg's playlist `text`."""
+    durations = list(gaps) + [d for d, _ in playlist_segments(text)]
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:8",
+        f"#EXT-X-TARGETDURATION:{math.ceil(max(durations, default=1))}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:EVENT",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+    ]
+    body = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-MAP'):
+            lines.append(line)
+        elif line.startswith('#EXTINF') or line == '#EXT-X-ENDLIST' or \
+                (line and not line.startswith('#')):
+            body.append(line)
+    for i, duration in enumerate(gaps):
+        lines += [f"#EXTINF:{duration:.6f},", "#EXT-X-GAP", f"gap_{i}.m4s"]
+    return "\n".join(lines + body) + "\n"
+
+
+def master_playlist(tracks, bandwidth):
+    """Master playlist: the video variant plus one audio rendition per track."""
+    default = next((t['index'] for t in tracks if t.get('default')), tracks[0]['index'])
+    lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for t in tracks:
+        attrs = [
+            'TYPE=AUDIO',
+            'GROUP-ID="audio"',
+            f'NAME="{track_name(t)}"',
+        ]
+        if t.get('language'):
+            attrs.append(f'LANGUAGE="{t["language"]}"')
+        attrs += [
+            f'DEFAULT={"YES" if t["index"] == default else "NO"}',
+            'AUTOSELECT=YES',
+            'CHANNELS="2"',
+            f'URI="{rendition_dir(t["index"])}/index.m3u8"',
+        ]
+        lines.append("#EXT-X-MEDIA:" + ",".join(attrs))
+    lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},AUDIO="audio"')
+    lines.append("index.m3u8")
+    return "\n".join(lines) + "\n"
+
+
+class AudioRenditions:
+    """The audio tracks of one stream job and the encodes started for them."""
+
+    def __init__(self, movie_path, preset, tracks, force_sync=False, keyframes=None,
+                 start_time=None, output_dir=None, output_url=None, store=None, store_prefix=""):
+        self.movie_path = movie_path
+        self.preset = preset
+        self.tracks = tracks
+        self.force_sync = force_sync
+        self.keyframes = keyframes
+        self.start_time = start_time
+        self.output_dir = output_dir
+        self.output_url = output_url
+        self.store = store
+        self.store_prefix = store_prefix
+        self.processes = {}
+        # Tracks whose encode exited with an error; they are not retried
+        self.failed = set()
+        # track -> durations of the video segments before its encode starts
+        self.gaps = {}
+        # client id -> last video segment it fetched (its playhead)
+        self._last_video = {}
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Publish the master playlist; no audio is encoded yet."""
+        text = master_playlist(self.tracks, estimate_bandwidth(self.preset))
+        if self.store is not None:
+            self.store.put(self.store_prefix + "master.m3u8", text.encode('utf-8'))
+        else:
+            (Path(self.output_dir) / "master.m3u8").write_text(text)
+        return self
+
+    def _read(self, name):
+        if self.store is not None:
+            data = self.store.get(self.store_prefix + name)
+            return data.decode('utf-8', 'replace') if data is not None else None
+        try:
+            return (Path(self.output_dir) / name).read_text()
+        except OSError:
+            return None
+
+    def _write(self, name, text):
+        if self.store is not None:
+            self.store.put(self.store_prefix + name, text.encode('utf-8'))
+            return
+        path = Path(self.output_dir) / name
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_text(text)
+        os.replace(tmp, path)
+
+    def _start_gaps(self, last_video):
+        """Durations of the video segments more than LEAD_SECONDS before `last_video`."""
+        if last_video is None:
+            return []
+        segments = playlist_segments(self._read("index.m3u8"))
+        uris = [uri for _, uri in segments]
+        if last_video not in uris:
+            return []
+        before = [d for d, _ in segments[:uris.index(last_video)]]
+        limit = sum(before) - LEAD_SECONDS
+        gaps = []
+        for d in before:
+            if sum(gaps) + d > limit:
+                break
+            gaps.append(d)
+        return gaps
+
+    def _check(self, track, process):
+        """Record `track` as failed once its encode exited with an error."""
+        if track not in self.failed and process.poll() not in (None, 0):
+            print(f"Audio rendition {track} for {self.movie_path} failed "
+                  f"(exit code {process.returncode})")
+            self.failed.add(track)
+
+    def failures(self):
+        """Indexes of the tracks whose encode failed."""
+        with self._lock:
+            for track, process in self.processes.items():
+                self._check(track, process)
+            return sorted(self.failed)
+
+    def ensure(self, track, client_id=None):
+        """Start the encode for `track` unless it is running, finished or failed.
+
+        A new encode starts just before the playhead of `client_id`.
+        """
+        with self._lock:
+            if self._stopped or track in self.failed or \
+                    not any(t['index'] == track for t in self.tracks):
+                return None
+            process = self.processes.get(track)
+            if process is not None:
+                self._check(track, process)
+                return None if track in self.failed else process
+            gaps = self._start_gaps(self._last_video.get(client_id))
+            output_url = f"{self.output_url}/{rendition_dir(track)}" if self.output_url else None
+            cmd, _ = build_audio_command(
+                self.movie_path,
+                self.preset,
+                track,
+                force_sync=self.force_sync,
+                keyframes=self.keyframes,
+                start_time=self.start_time,
+                output_url=output_url,
+                ts_offset=sum(gaps) if gaps else None,
+                name_prefix=OFFSET_PREFIX if gaps else ""
+            )
+            work_dir = Path(self.output_dir) / rendition_dir(track)
+            work_dir.mkdir(parents=True, exist_ok=True)
+            print(f"Starting audio rendition {track} for {self.movie_path} at {sum(gaps):.1f}s")
+            process = FFmpegProcess(cmd, cwd=str(work_dir))
+            self.processes[track] = process
+            self.gaps[track] = gaps
+            return process
+
+    def request(self, name, client_id=None):
+        """Called for every /hls fetch of the job; starts a rendition on its first playlist request.
+
+        Video segment fetches track each client's playhead. Returns True
+        while a requested rendition is encoding but has no playlist yet;
+        the caller answers with a retry instead of waiting for it.
+        """
+        if _VIDEO_SEGMENT_RE.match(name):
+            self._last_video[client_id] = name
+            return False
+        m = _PLAYLIST_RE.match(name)
+        if not m:
+            return False
+        track = int(m.group(1))
+        process = self.ensure(track, client_id)
+        if process is None:
+            return False
+        gaps = self.gaps.get(track)
+        source = f"{rendition_dir(track)}/{OFFSET_PREFIX}index.m3u8" if gaps else name
+        text = self._read(source)
+        if text is None:
+            return process.poll() in (None, 0)
+        if gaps:
+            self._write(name, gap_playlist(gaps, text))
+        return False
+
+    def terminate(self):
+        with self._lock:
+            self._stopped = True
+            for process in self.processes.values():
+                if process.poll() is None:
+                    process.terminate()
+
+    def wait(self, timeout=None):
+        for process in list(self.processes.values()):
+            process.wait(timeout)
@@ -0,0 +1,277 @@
+"""In-memory HLS segment store fed by FFmpeg over a loopback HTTP ingest server."""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import SEGMENT_STORE_MAX_MB, INGEST_PORT
+
+CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+}
+
+_SEGMENT_RE = re.compile(r'(?:r(\d+)_)?chunk_(\d+)\.m4s$')
+_URI_ATTR_RE = re.compile(r'URI="([^"]*)"')
+
+
+def segment_number(name):
+    """Return the (range, sequence) position of a chunk name, or None.
+
+    Plain chunk_N.m4s names are range 0; ranged encodes use rR_chunk_N.m4s.
+    """
+    m = _SEGMENT_RE.search(name)
+    if not m:
+        return None
+    return (int(m.group(1) or 0), int(m.group(2)))
+
+
+def content_type_for(name):
+    for ext, ctype in CONTENT_TYPES.items():
+        if name.endswith(ext):
+            return ctype
+    return 'application/octet-stream'
+
+
+def playlist_with_query(text, query):
+    """Append `query` to every URI in a playlist, so players send it with each request."""
+    def tag(uri):
+        return uri + ('&' if '?' in uri else '?') + query
+    lines = []
+    for line in text.splitlines():
+        if line.startswith('#'):
+            line = _URI_ATTR_RE.sub(lambda m: f'URI="{tag(m.group(1))}"', line)
+        elif line.strip():
+            line = tag(line.strip())
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+class SegmentStore:
+    """Size-bounded store of playlists and segments kept in RAM.
+
+    Segments are dropped once every active client has fetched a later one.
+    Segments nobody has played yet are never evicted: when the store is full,
+    putting a new segment waits for clients to move on, which stalls FFmpeg's
+    upload. It only gives up when the job's output is cleared (the stream was
+    stopped), so nothing the playlist lists goes missing. A client counts as
+    active while it fetches segments or polls the playlist, so a paused
+    player keeps its place. Playlists and the init segment are never evicted
+    and always accepted.
+
+    Segments within `admit_ahead` of the playhead (including the start of the
+    next range) are accepted even over budget. Otherwise parallel encodes of
+    ranges far ahead could fill the store and starve the range being watched.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, keep_behind=2, client_timeout=60,
+                 admit_ahead=10):
+        self.max_bytes = max_bytes
+        self.keep_behind = keep_behind
+        self.admit_ahead = admit_ahead
+        self.client_timeout = client_timeout
+        self._files = OrderedDict()
+        self._size = 0
+        self._clients = {}
+        # Bumped by clear() so puts waiting for room give up on stopped jobs
+        self._generation = 0
+        self._cleared = {}
+        self._lock = threading.Condition()
+
+    def put(self, name, data, timeout=None):
+        """Store a file, waiting for room if needed.
+
+        Returns False if the job's output was cleared while waiting, or
+        `timeout` (no limit by default) passed first.
+        """
+        job = name.partition('/')[0]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            started = (self._generation, self._cleared.get(job, 0))
+            while not self._has_room(name, len(data)):
+                remaining = 1.0 if deadline is None else deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._lock.wait(min(remaining, 1.0))
+                if (self._generation, self._cleared.get(job, 0)) != started:
+                    return False
+            old = self._files.pop(name, None)
+            if old is not None:
+                self._size -= len(old)
+            self._files[name] = data
+            self._size += len(data)
+            return True
+
+    def get(self, name):
+        with self._lock:
+            return self._files.get(name)
+
+    def delete(self, name):
+        with self._lock:
+            old = self._files.pop(name, None)
+            if old is not None:
+                self._size -= len(old)
+            self._lock.notify_all()
+
+    def clear(self, prefix=None):
+        """Drop everything, or only the files under `prefix/` (one job's output)."""
+        with self._lock:
+            if prefix is None:
+                self._files.clear()
+                self._clients.clear()
+                self._size = 0
+                self._generation += 1
+            else:
+                for key in [k for k in self._files if k.startswith(prefix + '/')]:
+                    self._size -= len(self._files.pop(key))
+                self._clients = {c: v for c, v in self._clients.items()
+                                 if c[0] != prefix and not c[0].startswith(prefix + '/')}
+                self._cleared[prefix] = self._cleared.get(prefix, 0) + 1
+            self._lock.notify_all()
+
+    def size(self):
+        with self._lock:
+            return self._size
+
+    def client_fetched(self, client_id, name):
+        """Record that `client_id` fetched `name` and drop segments all clients have passed.
+
+        Positions are tracked per directory prefix, so each job's output is
+        evicted only against the clients watching that job. A playlist fetch
+        keeps the client's position under that prefix alive.
+        """
+        seq = segment_number(name)
+        prefix = name.rpartition('/')[0]
+        now = time.monotonic()
+        if seq is None:
+            if name.endswith('.m3u8'):
+                with self._lock:
+                    entry = self._clients.get((prefix, client_id))
+                    if entry is not None:
+                        self._clients[(prefix, client_id)] = (entry[0], now)
+            return
+        with self._lock:
+            self._clients[(prefix, client_id)] = (seq, now)
+            self._clients = {c: v for c, v in self._clients.items() if now - v[1] < self.client_timeout}
+            active = [s for (p, _), (s, _) in self._clients.items() if p == prefix]
+            floor_range, floor_seq = min(active)
+            floor = (floor_range, floor_seq - self.keep_behind)
+            for key in list(self._files):
+                if key.rpartition('/')[0] != prefix:
+                    continue
+                n = segment_number(key)
+                if n is not None and n < floor:
+                    self._size -= len(self._files.pop(key))
+            self._lock.notify_all()
+
+    def _positions(self):
+        """Earliest (range, sequence) fetched by an active client, per prefix."""
+        now = time.monotonic()
+        positions = {}
+        for (prefix, _), (seq, seen) in self._clients.items():
+            if now - seen < self.client_timeout:
+                positions[prefix] = min(seq, positions.get(prefix, seq))
+        return positions
+
+    def _near_playhead(self, seq, playhead):
+        """True for segments behind the playhead or the next few it will need."""
+        rng, n = seq
+        p_rng, p_n = playhead
+        if seq < playhead:
+            return True
+        if rng == p_rng:
+            return n <= p_n + self.admit_ahead
+        return rng == p_rng + 1 and n <= self.admit_ahead
+
+    def _has_room(self, name, size):
+        """Make room for `size` bytes by evicting only played segments."""
+        seq = segment_number(name)
+        if seq is None or self._size + size <= self.max_bytes:
+            return True
+        positions = self._positions()
+        if self._near_playhead(seq, positions.get(name.rpartition('/')[0], (0, 0))):
+            return True
+        for key in list(self._files):
+            n = segment_number(key)
+            playhead = positions.get(key.rpartition('/')[0])
+            # Only what every client watching this output has already passed
+            if n is None or playhead is None or n >= playhead:
+                continue
+            self._size -= len(self._files.pop(key))
+            if self._size + size <= self.max_bytes:
+                return True
+        return False
+
+
+class _IngestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _read_body(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            parts = []
+            while True:
+                line = self.rfile.readline()
+                size = int(line.split(b';', 1)[0].strip() or b'0', 16)
+                if size == 0:
+                    # Consume trailers up to the blank line
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(parts)
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length)
+
+    def _reply(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_PUT(self):
+        name = self.path.lstrip('/').split('?', 1)[0]
+        if not self.server.store.put(name, self._read_body()):
+            # The stream was stopped while the upload waited for room
+            self._reply(503)
+            return
+        self._reply(201)
+
+    do_POST = do_PUT
+
+    def do_DELETE(self):
+        self.server.store.delete(self.path.lstrip('/').split('?', 1)[0])
+        self._reply(204)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class IngestServer:
+    """Loopback-only HTTP server that FFmpeg PUTs its HLS output to."""
+
+    def __init__(self, store, host='127.0.0.1', port=0):
+        self.store = store
+        self.host = host
+        self.port = port
+        self._httpd = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the server on first use and return its base URL."""
+        with self._lock:
+            if self._httpd is None:
+                httpd = ThreadingHTTPServer((self.host, self.port), _IngestHandler)
+                httpd.daemon_threads = True
+                httpd.store = self.store
+                threading.Thread(target=httpd.serve_forever, daemon=True).start()
+                self._httpd = httpd
+            host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+# Global instances - imported where needed
+segment_store = SegmentStore(max_bytes=SEGMENT_STORE_MAX_MB * 1024 * 1024)
+ingest_server = IngestServer(segment_store, port=INGEST_PORT)
@@ -0,0 +1,259 @@
+"""Seek-preview (trickplay) sprite sheets with a WebVTT thumbnail index.
+
+Sheets are generated on a background thread at idle CPU priority. FFmpeg
+decodes keyframes only (-skip_frame nokey) and each invocation fills one whole
+sheet, so a film needs a handful of short runs rather than one decode per
+thumbnail. Thumbnails sit on keyframes spaced TRICKPLAY_INTERVAL apart, taken
+from the keyframe index, which also gives the exact cue times for the VTT.
+
+Results live under TRICKPLAY_DIR/<key>/, where the key changes whenever the
+file does. The cache is bounded by TRICKPLAY_MAX_MB and evicts the least
+recently viewed files first. A file that fails is retried after
+FAILURE_RETRY_SECONDS, or as soon as it changes.
+"""
+
+import hashlib
+import math
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from config import TRICKPLAY_DIR, TRICKPLAY_MAX_MB, TRICKPLAY_INTERVAL
+from utils.ffmpeg import get_video_metadata
+from utils.keyframes import file_identity, keyframe_indexer
+
+VTT_NAME = 'thumbs.vtt'
+FAILURE_RETRY_SECONDS = 600
+
+
+def cache_key(file_path):
+    """Stable id for one version of a file."""
+    path, size, mtime = file_identity(file_path)
+    return hashlib.sha1(f"{path}|{size}|{mtime}".encode('utf-8')).hexdigest()[:16]
+
+
+def idle_priority(cmd):
+    """Return (cmd, Popen kwargs) that run `cmd` at the lowest CPU priority.
+
+    POSIX uses a `nice` prefix rather than preexec_fn, which is not safe to
+    use from a threaded process.
+    """
+    if os.name == 'nt':
+        return cmd, {"creationflags": subprocess.IDLE_PRIORITY_CLASS}
+    if shutil.which('nice'):
+        return ["nice", "-n", "19"] + cmd, {}
+    return cmd, {}
+
+
+def thumb_size(metadata, width=160):
+    """Thumbnail (width, height) keeping the source aspect ratio, height rounded to even."""
+    try:
+        w, h = (int(x) for x in metadata['resolution'].split('x'))
+        height = max(2, round(width * h / w / 2) * 2)
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        height = round(width * 9 / 16 / 2) * 2
+    return width, height
+
+
+def vtt_timestamp(seconds):
+    ms = int(round(seconds * 1000))
+    h, ms = divmod(ms, 3_600_000)
+    m, ms = divmod(ms, 60_000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}"
+
+
+def build_vtt(times, duration, size, columns, rows):
+    """WebVTT cues pointing each time span at its tile in a sprite sheet."""
+    w, h = size
+    per_sheet = columns * rows
+    lines = ["WEBVTT", ""]
+    for i, start in enumerate(times):
+        end = times[i + 1] if i + 1 < len(times) else max(duration or 0, start + TRICKPLAY_INTERVAL)
+        sheet, tile = divmod(i, per_sheet)
+        row, col = divmod(tile, columns)
+        lines.append(f"{vtt_timestamp(0 if i == 0 else start)} --> {vtt_timestamp(end)}")
+        lines.append(f"sprite_{sheet:03d}.jpg#xywh={col * w},{row * h},{w},{h}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def build_sheet_command(movie_path, start, end, interval, size, columns, rows, output):
+    """FFmpeg command that tiles the keyframe thumbnails between `start` and `end` into one JPEG.
+
+    Only keyframes are decoded; the select filter keeps the first one and then
+    each keyframe at least `interval` after the last kept one, the same rule
+    as KeyframeIndex.boundaries().
+    """
+    cmd = ["ffmpeg", "-y", "-nostdin", "-v", "error", "-threads", "1",
+           "-skip_frame", "nokey"]
+    if start:
+        # Round down: a seek rounded up past the keyframe would skip its thumbnail
+        cmd += ["-ss", f"{math.floor(start * 1000) / 1000:.3f}"]
+    if end is not None:
+        cmd += ["-t", f"{end - start:.3f}"]
+    cmd += ["-i", movie_path, "-an", "-sn", "-dn"]
+    cmd += [
+        "-vf", (f"select='isnan(prev_selected_t)+gte(t-prev_selected_t\\,{interval})',"
+                f"scale={size[0]}:{size[1]},tile={columns}x{rows}"),
+        "-vsync", "vfr",
+        "-frames:v", "1",
+        "-q:v", "5",
+        output
+    ]
+    return cmd
+
+
+class TrickplayCache:
+    """Generates sprite sheets in the background and keeps them in a bounded disk cache."""
+
+    def __init__(self, root=TRICKPLAY_DIR, max_bytes=TRICKPLAY_MAX_MB * 1024 * 1024,
+                 interval=TRICKPLAY_INTERVAL, width=160, columns=10, rows=10):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.width = width
+        self.columns = columns
+        self.rows = rows
+        self._pending = set()
+        # key -> time its generation failed
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def url_for(self, key):
+        return f"/trickplay/{key}/{VTT_NAME}"
+
+    def _ready(self, key):
+        return (self.root / key / VTT_NAME).exists()
+
+    def _known_failed(self, key):
+        """True if `key` failed less than FAILURE_RETRY_SECONDS ago; call with the lock held."""
+        failed_at = self._failed.get(key)
+        if failed_at is None:
+            return False
+        if time.monotonic() - failed_at < FAILURE_RETRY_SECONDS:
+            return True
+        del self._failed[key]
+        return False
+
+    def status(self, file_path):
+        """Return (key, "ready" | "pending" | "failed"), or (None, None) if the file is missing."""
+        try:
+            key = cache_key(file_path)
+        except OSError:
+            return None, None
+        if self._ready(key):
+            return key, "ready"
+        with self._lock:
+            if self._known_failed(key):
+                return key, "failed"
+        return key, "pending"
+
+    def request(self, file_path):
+        """Queue `file_path` unless its sheets are cached, queued or known to fail; returns its key."""
+        try:
+            key = cache_key(file_path)
+        except OSError:
+            return None
+        if self._ready(key):
+            return key
+        with self._lock:
+            if key in self._pending or self._known_failed(key):
+                return key
+            self._pending.add(key)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        self._queue.put((key, file_path))
+        return key
+
+    def file_path(self, key, name):
+        """Path of a cached file; viewing the index marks the entry as recently used."""
+        path = self.root / key / name
+        if name == VTT_NAME and path.exists():
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path
+
+    def _run(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Drop half-written output from a previous run
+        for d in self.root.glob('*.tmp'):
+            shutil.rmtree(d, ignore_errors=True)
+        while True:
+            key, file_path = self._queue.get()
+            try:
+                self.generate(key, file_path)
+                self.evict(keep=key)
+            except Exception as e:
+                print(f"Error generating trickplay for {file_path}: {e}")
+                with self._lock:
+                    self._failed[key] = time.monotonic()
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+    def generate(self, key, file_path):
+        metadata = get_video_metadata(file_path)
+        if metadata is None:
+            raise RuntimeError("could not probe file")
+        keyframes = keyframe_indexer.wait(file_path)
+        if keyframes is None or not len(keyframes):
+            raise RuntimeError("no keyframe index")
+
+        times = keyframes.boundaries(self.interval)
+        size = thumb_size(metadata, self.width)
+        per_sheet = self.columns * self.rows
+        work = self.root / f"{key}.tmp"
+        shutil.rmtree(work, ignore_errors=True)
+        work.mkdir(parents=True)
+
+        for sheet, first in enumerate(range(0, len(times), per_sheet)):
+            start = times[first]
+            end = times[first + per_sheet] if first + per_sheet < len(times) else None
+            cmd, kwargs = idle_priority(build_sheet_command(
+                file_path, start, end, self.interval, size,
+                self.columns, self.rows, f"sprite_{sheet:03d}.jpg"))
+            result = subprocess.run(cmd, cwd=str(work), stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE, **kwargs)
+            if result.returncode != 0:
+                shutil.rmtree(work, ignore_errors=True)
+                message = result.stderr.decode('utf-8', 'replace').strip().splitlines()
+                raise RuntimeError(message[-1] if message else f"ffmpeg exited with code {result.returncode}")
+
+        (work / VTT_NAME).write_text(
+            build_vtt(times, metadata.get('duration'), size, self.columns, self.rows))
+        shutil.rmtree(self.root / key, ignore_errors=True)
+        os.replace(work, self.root / key)
+        print(f"Trickplay ready for {file_path} ({len(times)} thumbnails)")
+
+    def evict(self, keep=None):
+        """Remove the least recently viewed entries until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        for d in self.root.iterdir():
+            vtt = d / VTT_NAME
+            if not d.is_dir() or d.suffix == '.tmp' or not vtt.exists():
+                continue
+            size = sum(f.stat().st_size for f in d.iterdir() if f.is_file())
+            entries.append((vtt.stat().st_mtime, size, d))
+            total += size
+        for _, size, d in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if d.name == keep:
+                continue
+            shutil.rmtree(d, ignore_errors=True)
+            total -= size
+
+
+# Global instance - imported where needed
+trickplay_cache = TrickplayCache()
@@ -0,0 +1,337 @@
+"""Remote transcode workers: leasing, heartbeats and placement on the web node.
+
+Workers (see worker.py) poll /api/workers/heartbeat. The reply carries new
+job assignments and cancellations. Each assignment holds a lease that the
+worker renews by listing the job in later heartbeats. If a worker stops
+heartbeating, or stops reporting a leased job, the job continues on another
+worker as a new attempt. That attempt starts at the end of the last uploaded
+segment and writes under its own rNNNN_ prefix. The attempts' playlists are
+stitched into one index.m3u8, like parallel ranges. When no worker has a free
+slot the next attempt runs as a local FFmpeg process instead.
+"""
+
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from config import PRESETS, WORKER_TIMEOUT, WORKER_LEASE_SECONDS
+from utils.ffmpeg import build_ffmpeg_command, FFmpegProcess
+from utils.parallel import range_prefix, stitch_playlists, playlist_seconds
+from utils.segment_store import ingest_server
+
+MAX_ATTEMPTS = 3
+EXPIRE_INTERVAL = 1
+
+# Worker id of attempts that run on this node
+LOCAL = "local"
+
+
+class RemoteTranscode:
+    """A stream encoded on a worker node.
+
+    Quacks like subprocess.Popen (poll/terminate) so it can stand in for
+    the FFmpeg process of a StreamJob.
+    """
+
+    def __init__(self, pool, job_id, spec, output_dir, store=None, hls_time=6):
+        self.pool = pool
+        self.id = job_id
+        self.spec = spec
+        self.output_dir = output_dir
+        self.store = store
+        self.hls_time = hls_time
+        self.attempts = []
+        self.worker = None
+        self.lease = None
+        self.lease_expires = 0
+        self.delivered = False
+        self.cancelled = False
+        self.returncode = None
+        self.error = None
+        # FFmpegProcess of an attempt running locally
+        self.local = None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        """Wait for a local attempt to exit; remote uploads stop with the lease."""
+        local = self.local
+        if local is not None:
+            local.wait(timeout)
+        return self.returncode
+
+    def terminate(self):
+        self.pool.cancel(self)
+
+    # -- attempts ----------------------------------------------------------
+
+    def new_attempt(self, worker_id):
+        """Lease the job to `worker_id`, resuming after what was already uploaded."""
+        done = sum(playlist_seconds(self.read(f"{a['prefix']}index.m3u8")) for a in self.attempts)
+        for a in self.attempts:
+            a['closed'] = True
+        self.attempts.append({
+            "prefix": range_prefix(len(self.attempts)),
+            "offset": done,
+            "closed": False,
+        })
+        self.worker = worker_id
+        self.lease = uuid.uuid4().hex
+        self.lease_expires = time.monotonic() + WORKER_LEASE_SECONDS
+        self.delivered = False
+
+    def assignment(self):
+        """What the worker needs to build and run the FFmpeg command."""
+        attempt = self.attempts[-1]
+        start = float(self.spec.get('start_time') or 0) + attempt['offset']
+        return dict(self.spec,
+                    job_id=self.id,
+                    lease=self.lease,
+                    start_time=start,
+                    ts_offset=attempt['offset'],
+                    name_prefix=attempt['prefix'],
+                    upload_path=f"/api/workers/upload/{self.id}/{self.lease}")
+
+    # -- output ------------------------------------------------------------
+
+    def read(self, name):
+        if self.store is not None:
+            data = self.store.get(f"{self.id}/{name}")
+            return data.decode('utf-8', 'replace') if data is not None else None
+        try:
+            return (Path(self.output_dir) / name).read_text()
+        except OSError:
+            return None
+
+    def write(self, name, data):
+        if self.store is not None:
+            return self.store.put(f"{self.id}/{name}", data)
+        path = Path(self.output_dir) / name
+        # Upload requests run on several threads; never share a temp file
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        return True
+
+    def write_playlist(self):
+        # An attempt that was replaced before uploading anything adds no segments
+        parts = ((self.read(f"{a['prefix']}index.m3u8") or ("" if a['closed'] else None),
+                  a['closed'] or self.returncode == 0)
+                 for a in self.attempts)
+        self.write("index.m3u8", stitch_playlists(parts, self.hls_time).encode('utf-8'))
+
+
+class WorkerPool:
+    """Registry of live workers and the remote jobs leased to them."""
+
+    def __init__(self):
+        self.workers = {}
+        self.jobs = {}
+        self._lock = threading.RLock()
+        self._timer = None
+
+    def _ensure_timer(self):
+        """Expire dead workers and leases even when no heartbeat or request arrives."""
+        if self._timer is None or not self._timer.is_alive():
+            self._timer = threading.Thread(target=self._expire_loop, daemon=True)
+            self._timer.start()
+
+    def _expire_loop(self):
+        while True:
+            time.sleep(EXPIRE_INTERVAL)
+            with self._lock:
+                self._expire()
+
+    def _load(self, worker_id):
+        return sum(1 for j in self.jobs.values() if j.worker == worker_id and j.returncode is None)
+
+    def _least_loaded(self, exclude=None):
+        best = None
+        for worker_id, w in self.workers.items():
+            if worker_id == exclude:
+                continue
+            load = self._load(worker_id)
+            if load >= w['capacity']:
+                continue
+            score = load / w['capacity']
+            if best is None or score < best[0]:
+                best = (score, worker_id)
+        return best[1] if best else None
+
+    def submit(self, job_id, spec, output_dir, store=None, hls_time=6):
+        """Place a new stream on the least-loaded worker; None if all are busy."""
+        with self._lock:
+            self._expire()
+            worker_id = self._least_loaded()
+            if worker_id is None:
+                return None
+            job = RemoteTranscode(self, job_id, spec, output_dir, store, hls_time)
+            job.new_attempt(worker_id)
+            self.jobs[job_id] = job
+            self._ensure_timer()
+            return job
+
+    def cancel(self, job):
+        with self._lock:
+            job.cancelled = True
+            if job.returncode is None:
+                job.returncode = -15
+            if job.local is not None and job.local.poll() is None:
+                job.local.terminate()
+            if job.worker not in self.workers:
+                self.jobs.pop(job.id, None)
+
+    def lease_valid(self, job_id, lease):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.lease != lease or job.cancelled:
+                return None
+            return job
+
+    def _reassign(self, job, reason):
+        old = job.worker
+        if len(job.attempts) >= MAX_ATTEMPTS:
+            print(f"Remote job {job.id} failed: {reason}")
+            job.returncode = 1
+            job.error = reason
+            job.worker = None
+            self.jobs.pop(job.id, None)
+            return
+        worker_id = self._least_loaded(exclude=old) or self._least_loaded()
+        print(f"Reassigning remote job {job.id} from {old} to {worker_id or LOCAL}: {reason}")
+        if worker_id is None:
+            self._run_local(job)
+            return
+        job.new_attempt(worker_id)
+
+    def _run_local(self, job):
+        """Continue `job` on this node when no worker can take it."""
+        job.new_attempt(LOCAL)
+        job.delivered = True
+        a = job.assignment()
+        output_url = None
+        if job.store is not None:
+            output_url = f"{ingest_server.ensure_started()}/{job.id}"
+        try:
+            cmd, _ = build_ffmpeg_command(
+                a['movie_path'],
+                PRESETS[a['preset']],
+                a['metadata'],
+                a.get('sub_path'),
+                force_sync=a.get('force_sync', False),
+                start_time=a['start_time'],
+                output_url=output_url,
+                ts_offset=a['ts_offset'],
+                name_prefix=a['name_prefix'],
+                audio=a.get('audio', True)
+            )
+            job.local = FFmpegProcess(cmd, cwd=job.output_dir)
+        except Exception as e:
+            # Fail the job so the client sees an error instead of a stalled stream
+            print(f"Remote job {job.id} failed: could not run locally: {e}")
+            job.returncode = 1
+            job.error = str(e)
+            self.jobs.pop(job.id, None)
+            return
+        threading.Thread(target=self._watch_local, args=(job, job.lease), daemon=True).start()
+
+    def _watch_local(self, job, lease):
+        """Stitch the playlist while a local attempt runs, then settle the job."""
+        process = job.local
+        while process.poll() is None:
+            time.sleep(EXPIRE_INTERVAL)
+            with self._lock:
+                if job.lease == lease and not job.cancelled:
+                    job.write_playlist()
+        with self._lock:
+            if job.lease != lease or job.cancelled:
+                return
+            job.local = None
+            if process.returncode == 0:
+                job.returncode = 0
+                job.write_playlist()
+                self.jobs.pop(job.id, None)
+            else:
+                self._reassign(job, f"local ffmpeg exited with code {process.returncode}")
+
+    def _expire(self):
+        now = time.monotonic()
+        for worker_id in [w for w, info in self.workers.items()
+                          if now - info['seen'] > WORKER_TIMEOUT]:
+            print(f"Worker {self.workers[worker_id]['name']} timed out")
+            del self.workers[worker_id]
+        for job in list(self.jobs.values()):
+            if job.cancelled:
+                if job.worker not in self.workers:
+                    self.jobs.pop(job.id, None)
+                continue
+            if job.returncode is not None or job.worker == LOCAL:
+                continue
+            if job.worker not in self.workers:
+                self._reassign(job, "worker went away")
+            elif job.delivered and now > job.lease_expires:
+                self._reassign(job, "lease expired")
+
+    def heartbeat(self, worker_id, name, capacity, running, finished):
+        """Record a worker heartbeat; returns {"assign": [...], "cancel": [...]}."""
+        now = time.monotonic()
+        with self._lock:
+            self.workers[worker_id] = {"name": name, "capacity": max(1, int(capacity)), "seen": now}
+            self._ensure_timer()
+
+            for report in finished:
+                job = self.jobs.get(report.get('job_id'))
+                if job is None or job.lease != report.get('lease'):
+                    continue
+                if job.cancelled:
+                    self.jobs.pop(job.id, None)
+                elif report.get('returncode') == 0:
+                    job.returncode = 0
+                    job.write_playlist()
+                    self.jobs.pop(job.id, None)
+                else:
+                    self._reassign(job, report.get('error') or f"exit code {report.get('returncode')}")
+
+            for job_id, lease in running.items():
+                job = self.jobs.get(job_id)
+                if job is not None and job.lease == lease:
+                    job.lease_expires = now + WORKER_LEASE_SECONDS
+
+            self._expire()
+
+            assign, cancel = [], []
+            for job in list(self.jobs.values()):
+                if job.worker != worker_id:
+                    if job.id in running:
+                        cancel.append(job.id)
+                    continue
+                if job.cancelled:
+                    cancel.append(job.id)
+                    self.jobs.pop(job.id, None)
+                elif job.returncode is None and not job.delivered:
+                    assign.append(job.assignment())
+                    job.delivered = True
+                    job.lease_expires = now + WORKER_LEASE_SECONDS
+            return {"assign": assign, "cancel": cancel}
+
+    def status(self):
+        with self._lock:
+            self._expire()
+            return {
+                "workers": [
+                    {"id": w, "name": info['name'], "capacity": info['capacity'], "load": self._load(w)}
+                    for w, info in self.workers.items()
+                ],
+                "jobs": [
+                    {"id": j.id, "worker": j.worker, "attempts": len(j.attempts),
+                     "returncode": j.returncode, "error": j.error}
+                    for j in self.jobs.values()
+                ],
+            }
+
+
+# Global instance - imported where needed
+worker_pool = WorkerPool()
@@ -4,6 +4,13 @@ const folderIndex = parseInt(urlParams.get('f'));
 let folder = null;
 let availablePresets = [];
 
+// Identifies this tab to the server so viewers of the same title can share one transcode
+let clientId = sessionStorage.getItem('bedtime-client-id');
+if (!clientId) {
+    clientId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+    sessionStorage.setItem('bedtime-client-id', clientId);
+}
+
 // Global functions for onclick
 window.goBack = function() {
     window.location.href = '/';
@@ -15,7 +22,11 @@ window.stopStream = async function() {
     statusBar.style.display = 'block';
     
     try {
-        await fetch('/api/stop', { method: 'POST' });
+        await fetch('/api/stop', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({ client_id: clientId })
+        });
         statusBar.textContent = 'Stream stopped';
         setTimeout(() => {
             statusBar.style.display = 'none';
@@ -36,7 +47,7 @@ window.startEpisode = async function(epIdx) {
   statusBar.textContent = `Preparing: ${ep.name}...`;
   statusBar.style.display = 'block';
   
-  window.open('/player', 'bedtime-player');
+  const playerWindow = window.open('/player?pending=1', 'bedtime-player');
   
   const probeRes = await fetch('/api/probe', {
     method: 'POST',
@@ -45,11 +56,12 @@ window.startEpisode = async function(epIdx) {
   });
   const metadata = await probeRes.json();
   
-  await fetch('/api/start', {
+  const startRes = await fetch('/api/start', {
     method: 'POST',
     headers: {'Content-Type': 'application/json'},
     body: JSON.stringify({
       path: ep.path,
+      client_id: clientId,
       preset: preset,
       sub_path: subPath,
       force_sync: forceSync,  
@@ -58,8 +70,33 @@ window.startEpisode = async function(epIdx) {
       pgs_sub_index: metadata.pgs_sub_index
     })
   });
+  const started = await startRes.json();
+  
+  // FFmpeg died on startup: show the reason now instead of waiting on retries
+  if (started.status === 'error') {
+    if (playerWindow) {
+      const params = new URLSearchParams({ error: started.message || started.error });
+      playerWindow.location.href = `/player?${params}`;
+    }
+    statusBar.textContent = `FAILED: ${ep.name} (${started.error})`;
+    return;
+  }
+  
+  // Point the player at whatever the server chose (direct file or HLS)
+  if (playerWindow && started.url) {
+    const params = new URLSearchParams({ mode: started.mode, src: started.url });
+    if (metadata.trickplay) {
+      params.set('thumbs', metadata.trickplay);
+    }
+    playerWindow.location.href = `/player?${params}`;
+  }
   
-  statusBar.textContent = `NOW STREAMING: ${ep.name}`;
+  statusBar.textContent = started.mode === 'direct'
+    ? `NOW PLAYING (direct): ${ep.name}`
+    : `NOW STREAMING: ${ep.name}`;
+  if (started.fallback_from) {
+    statusBar.textContent += ` (fell back to ${started.preset})`;
+  }
 };
 async function loadData() {
     const [libRes, preRes] = await Promise.all([
@@ -1,18 +1,26 @@
 /**
- * Player: handles HLS playback with native retry behavior
+ * Player: handles HLS playback with native retry behavior,
+ * or plays browser-native files directly
  */
 class Player {
-    constructor(videoElement, streamUrl) {
+    constructor(videoElement, streamUrl, mode = 'hls') {
         this.video = videoElement;
         this.streamUrl = streamUrl;
+        this.mode = mode;
         this.hls = null;
         this.loadingText = document.getElementById('loading-text');
         this.errorCount = 0;
         this.maxErrors = 10;
+        this.keepalive = null;
     }
 
     start() {
-        if (Hls.isSupported()) {
+        if (this.mode !== 'direct') {
+            this.startKeepalive();
+        }
+        if (this.mode === 'direct') {
+            this.initDirect();
+        } else if (Hls.isSupported()) {
             this.initHls();
         } else if (this.video.canPlayType('application/vnd.apple.mpegurl')) {
             this.initNative();
@@ -30,6 +38,9 @@ class Player {
             // Let Hls.js handle retries
             manifestLoadingMaxRetry: 20,
             manifestLoadingRetryDelay: 1000,
+            // Audio renditions answer 503 until their encode has a playlist
+            levelLoadingMaxRetry: 20,
+            levelLoadingRetryDelay: 1000,
             fragLoadingMaxRetry: 10,
             fragLoadingRetryDelay: 1000,
             startLevel: 0
@@ -55,8 +66,92 @@ class Player {
         this.hls.on(Hls.Events.ERROR, (event, data) => {
             if (data.fatal) {
                 this.handleFatalError(data);
+            } else if (data.details === Hls.ErrorDetails.AUDIO_TRACK_LOAD_ERROR) {
+                // Ask the server whether that track's encode failed
+                this.ping();
             }
         });
+
+        // Multi-language streams list each audio track as a rendition
+        this.hls.on(Hls.Events.AUDIO_TRACKS_UPDATED, (event, data) => {
+            this.showAudioTracks(data.audioTracks);
+        });
+    }
+
+    startKeepalive() {
+        // A paused player stops fetching once the playlist is complete; tell
+        // the server the tab is still open so the stream is not reaped
+        if (!this.clientId()) return;
+        this.keepalive = setInterval(() => this.ping(), 60000);
+    }
+
+    clientId() {
+        return new URL(this.streamUrl, window.location.href).searchParams.get('c');
+    }
+
+    ping() {
+        const clientId = this.clientId();
+        if (!clientId) return;
+        fetch('/api/ping', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({ client_id: clientId })
+        })
+            .then(res => res.json())
+            .then(data => this.markFailedAudio(data.audio_failed || []))
+            .catch(() => {});
+    }
+
+    markFailedAudio(failed) {
+        // Renditions are served from audioN/, N being the server's track index
+        const select = document.getElementById('audio-tracks');
+        if (!select || !this.hls || !failed.length) return;
+        this.hls.audioTracks.forEach((track, i) => {
+            const m = /audio(\d+)\/index\.m3u8/.exec(track.url || '');
+            const option = select.options[i];
+            if (!m || !option || option.disabled || !failed.includes(parseInt(m[1], 10))) return;
+            option.disabled = true;
+            option.textContent += ' (unavailable)';
+        });
+    }
+
+    showAudioTracks(tracks) {
+        const select = document.getElementById('audio-tracks');
+        if (!select) return;
+        if (!tracks || tracks.length < 2) {
+            select.style.display = 'none';
+            return;
+        }
+        select.innerHTML = '';
+        tracks.forEach((track, i) => {
+            const option = document.createElement('option');
+            option.value = i;
+            option.textContent = track.name || track.lang || `Track ${i + 1}`;
+            select.appendChild(option);
+        });
+        select.value = this.hls.audioTrack;
+        // The server starts transcoding a language the first time it is picked
+        select.onchange = () => {
+            this.hls.audioTrack = parseInt(select.value, 10);
+        };
+        select.style.display = 'block';
+    }
+
+    initDirect() {
+        // Plain progressive file; the browser seeks with Range requests
+        if (this.loadingText) {
+            this.loadingText.textContent = 'Loading...';
+        }
+        this.video.src = this.streamUrl;
+
+        this.video.addEventListener('loadedmetadata', () => {
+            this.hideLoading();
+            this.video.play().catch(e => console.log('Autoplay blocked'));
+        });
+
+        this.video.addEventListener('error', () => {
+            this.showError('This file cannot be played directly in this browser');
+        });
     }
 
     initNative() {
@@ -129,6 +224,10 @@ class Player {
     }
 
     destroy() {
+        if (this.keepalive) {
+            clearInterval(this.keepalive);
+            this.keepalive = null;
+        }
         if (this.hls) {
             this.hls.destroy();
             this.hls = null;
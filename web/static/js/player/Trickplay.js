@@ -0,0 +1,101 @@
+/**
+ * Trickplay: seek previews from pre-generated sprite sheets.
+ *
+ * Loads the WebVTT thumbnail index and shows the matching sprite tile while
+ * hovering the preview bar; clicking seeks. Previews are generated in the
+ * background, so a missing index is retried for a while.
+ */
+class Trickplay {
+    constructor(videoElement, vttUrl) {
+        this.video = videoElement;
+        this.vttUrl = vttUrl;
+        this.cues = [];
+        this.bar = document.getElementById('trickplay-bar');
+        this.preview = document.getElementById('trickplay-preview');
+        this.retries = 30;
+        this.hideTimer = null;
+    }
+
+    async start() {
+        if (!this.bar || !this.preview) return;
+        try {
+            const res = await fetch(this.vttUrl);
+            if (!res.ok) throw new Error(`HTTP ${res.status}`);
+            this.cues = this.parse(await res.text());
+        } catch (err) {
+            if (this.retries-- > 0) {
+                setTimeout(() => this.start(), 10000);
+            }
+            return;
+        }
+        if (this.cues.length) this.attach();
+    }
+
+    parse(text) {
+        const cues = [];
+        const base = new URL(this.vttUrl, window.location.href);
+        const blocks = text.split(/\r?\n\r?\n/);
+        for (const block of blocks) {
+            const lines = block.trim().split(/\r?\n/);
+            const timing = lines.findIndex(l => l.includes('-->'));
+            if (timing < 0 || !lines[timing + 1]) continue;
+            const [start, end] = lines[timing].split('-->').map(t => this.seconds(t.trim()));
+            const [file, hash] = lines[timing + 1].split('#xywh=');
+            const [x, y, w, h] = hash.split(',').map(Number);
+            cues.push({ start, end, url: new URL(file, base).href, x, y, w, h });
+        }
+        return cues;
+    }
+
+    seconds(stamp) {
+        const parts = stamp.split(':').map(Number);
+        return parts.reduce((total, part) => total * 60 + part, 0);
+    }
+
+    get duration() {
+        return this.cues[this.cues.length - 1].end;
+    }
+
+    timeAt(event) {
+        const rect = this.bar.getBoundingClientRect();
+        const fraction = Math.min(1, Math.max(0, (event.clientX - rect.left) / rect.width));
+        return { time: fraction * this.duration, x: event.clientX - rect.left, width: rect.width };
+    }
+
+    attach() {
+        // Only show the bar while the mouse is moving, like the native controls
+        document.addEventListener('mousemove', () => {
+            this.bar.style.display = 'block';
+            clearTimeout(this.hideTimer);
+            this.hideTimer = setTimeout(() => {
+                this.bar.style.display = 'none';
+                this.preview.style.display = 'none';
+            }, 3000);
+        });
+
+        this.bar.addEventListener('mousemove', (event) => {
+            const { time, x, width } = this.timeAt(event);
+            const cue = this.cues.find(c => time >= c.start && time < c.end) || this.cues[this.cues.length - 1];
+            this.preview.style.width = `${cue.w}px`;
+            this.preview.style.height = `${cue.h}px`;
+            this.preview.style.backgroundImage = `url("${cue.url}")`;
+            this.preview.style.backgroundPosition = `-${cue.x}px -${cue.y}px`;
+            this.preview.style.left = `${Math.min(Math.max(0, x - cue.w / 2), width - cue.w)}px`;
+            this.preview.style.display = 'block';
+        });
+
+        this.bar.addEventListener('mouseleave', () => {
+            this.preview.style.display = 'none';
+        });
+
+        this.bar.addEventListener('click', (event) => {
+            let { time } = this.timeAt(event);
+            // A stream still being transcoded can only seek as far as it has been encoded
+            const seekable = this.video.seekable;
+            if (seekable.length) {
+                time = Math.min(time, seekable.end(seekable.length - 1));
+            }
+            this.video.currentTime = time;
+        });
+    }
+}
@@ -2,9 +2,24 @@
  * Player entry point
  */
 document.addEventListener('DOMContentLoaded', () => {
-    const streamUrl = '/hls/index.m3u8';
+    const params = new URLSearchParams(window.location.search);
+
+    // The movie page reloads us with the real source once /api/start returns
+    if (params.get('pending')) return;
+
+    const mode = params.get('mode') || 'hls';
+    const streamUrl = params.get('src') || '/hls/index.m3u8';
     const video = document.getElementById('video');
 
-    const player = new Player(video, streamUrl);
+    const player = new Player(video, streamUrl, mode);
+    if (params.get('error')) {
+        player.showError(params.get('error'));
+        return;
+    }
     player.start();
+
+    // Seek previews, if the server has (or is building) sprite sheets for this file
+    if (params.get('thumbs')) {
+        new Trickplay(video, params.get('thumbs')).start();
+    }
 });
\ No newline at end of file
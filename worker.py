@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Bedtime Streamer - Transcode worker
+Runs FFmpeg jobs for a Bedtime Streamer web node and uploads the segments back
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+
+from config import PRESETS, PRESET_FALLBACKS, STARTUP_WATCH_SECONDS, WORKER_TOKEN
+from utils.ffmpeg import build_ffmpeg_command, FFmpegProcess
+
+
+def map_path(path, path_map):
+    """Translate a web-node path to this machine's mount of the same library."""
+    if not path:
+        return path
+    for remote, local in path_map:
+        if path.startswith(remote):
+            return local + path[len(remote):]
+    return path
+
+
+class Worker:
+    """Heartbeats to the web node and runs the jobs it leases to us."""
+
+    def __init__(self, server, capacity, name, path_map, token, interval=2):
+        self.server = server.rstrip('/')
+        self.capacity = capacity
+        self.name = name
+        self.path_map = path_map
+        self.token = token
+        self.interval = interval
+        self.worker_id = uuid.uuid4().hex
+        self.running = {}
+        self.finished = []
+
+    def post(self, path, payload):
+        req = urllib.request.Request(
+            self.server + path,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'X-Worker-Token': self.token},
+            method='POST'
+        )
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+
+    def start_job(self, job):
+        work_dir = tempfile.mkdtemp(prefix=f"bedtime-{job['job_id']}-")
+        movie_path = map_path(job['movie_path'], self.path_map)
+        sub_path = map_path(job.get('sub_path'), self.path_map)
+        output_url = self.server + job['upload_path']
+
+        preset_key = job['preset']
+        while preset_key is not None:
+            cmd, _ = build_ffmpeg_command(
+                movie_path,
+                PRESETS[preset_key],
+                job['metadata'],
+                sub_path,
+                force_sync=job.get('force_sync', False),
+                start_time=job.get('start_time'),
+                output_url=output_url,
+                ts_offset=job.get('ts_offset'),
+                name_prefix=job.get('name_prefix', ""),
+                audio=job.get('audio', True)
+            )
+            if self.token:
+                # Output option, so it has to sit with the HLS muxer options
+                i = len(cmd) - 1 - cmd[::-1].index("-f")
+                cmd[i:i] = ["-headers", f"X-Worker-Token: {self.token}\r\n"]
+            process = FFmpegProcess(cmd, cwd=work_dir)
+            failure = process.wait_for_startup(STARTUP_WATCH_SECONDS)
+            if failure is None:
+                print(f"Started {job['job_id']} ({preset_key}) from {job.get('start_time') or 0:.1f}s")
+                self.running[job['job_id']] = (job['lease'], process, work_dir)
+                return
+            print(f"{job['job_id']}: {preset_key} failed: {failure['message']}")
+            if failure['error'] != 'encoder_unavailable':
+                break
+            preset_key = PRESET_FALLBACKS.get(preset_key)
+
+        shutil.rmtree(work_dir, ignore_errors=True)
+        self.finished.append({"job_id": job['job_id'], "lease": job['lease'],
+                              "returncode": process.returncode, "error": failure['message']})
+
+    def stop_job(self, job_id):
+        lease, process, work_dir = self.running.pop(job_id)
+        if process.poll() is None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return lease, process
+
+    def reap(self):
+        for job_id, (lease, process, work_dir) in list(self.running.items()):
+            if process.poll() is None:
+                continue
+            self.stop_job(job_id)
+            error = None
+            if process.returncode != 0:
+                error = process.stderr_tail[-1] if process.stderr_tail else None
+            print(f"Finished {job_id} with code {process.returncode}")
+            self.finished.append({"job_id": job_id, "lease": lease,
+                                  "returncode": process.returncode, "error": error})
+
+    def tick(self):
+        self.reap()
+        reply = self.post('/api/workers/heartbeat', {
+            "worker_id": self.worker_id,
+            "name": self.name,
+            "capacity": self.capacity,
+            "running": {job_id: lease for job_id, (lease, _, _) in self.running.items()},
+            "finished": self.finished,
+        })
+        self.finished = []
+        for job_id in reply.get('cancel', []):
+            if job_id in self.running:
+                print(f"Cancelled {job_id}")
+                self.stop_job(job_id)
+        for job in reply.get('assign', []):
+            if job['job_id'] in self.running:
+                self.stop_job(job['job_id'])
+            self.start_job(job)
+
+    def run(self):
+        print(f"Worker {self.name} ({self.capacity} slots) -> {self.server}")
+        try:
+            while True:
+                try:
+                    self.tick()
+                except OSError as e:
+                    print(f"Heartbeat failed: {e}")
+                time.sleep(self.interval)
+        finally:
+            for job_id in list(self.running):
+                self.stop_job(job_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bedtime Streamer transcode worker')
+    parser.add_argument('--server', default='http://127.0.0.1:5000', help='Web node URL')
+    parser.add_argument('--capacity', type=int, default=1, help='Concurrent FFmpeg jobs')
+    parser.add_argument('--name', default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument('--path-map', action='append', default=[], metavar='REMOTE=LOCAL',
+                        help='Library path on the web node and where it is mounted here')
+    parser.add_argument('--token', default=WORKER_TOKEN, help='Shared secret (WORKER_TOKEN)')
+    args = parser.parse_args()
+
+    path_map = []
+    for item in args.path_map:
+        if '=' not in item:
+            parser.error(f"--path-map expects REMOTE=LOCAL, got {item}")
+        path_map.append(tuple(item.split('=', 1)))
+
+    worker = Worker(args.server, args.capacity, args.name, path_map, args.token)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        print("Worker stopped")
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()